@@ -0,0 +1,529 @@
+"""Offline benchmarks for the translation service.
+
+Runs ``main.app`` in-process with ``get_genai()`` / ``get_google_cloud_client()``
+swapped for local stub backends, so no API quota is used. Two suites:
+
+    load          concurrent requests against /translate and /translate/stream,
+                  reporting throughput and p50/p95/p99 latency per scenario
+    dictionaries  apply_dictionaries with 10 to 100k entries on inputs from
+                  one sentence to 50 KB
+
+Results are written as JSON (``--output``, stdout by default) so runs can be
+compared. Examples:
+
+    python benchmark.py load --requests 2000 --concurrency 64 --gemini-latency-ms 800
+    python benchmark.py load --scenario keyword --quota-rate 0.05 --keys 4
+    python benchmark.py dictionaries --output dictionaries.json
+    python benchmark.py all --output results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+import tempfile
+from types import SimpleNamespace
+
+# The app reads its configuration at import time: keep everything in memory,
+# don't let the per-key budgets or per-client limits throttle the load (every
+# benchmark request comes from one client), and keep the log quiet.
+os.environ.setdefault("DICTIONARY_STORE", "memory")
+os.environ.setdefault("JOBS_DIR", os.path.join(tempfile.gettempdir(), "fast-translation-benchmark-jobs"))
+os.environ.setdefault("GEMINI_KEY_RPM", "1000000000")
+os.environ.setdefault("GEMINI_KEY_TPM", "1000000000000")
+os.environ.setdefault("CLIENT_MAX_CONCURRENCY", "0")
+os.environ.setdefault("CLIENT_RPM", "0")
+os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+os.environ.pop("TRANSLATION_CACHE_PATH", None)
+# Generated texts differ only in numbers, which the translation memory would
+# answer without an upstream call; hot_fraction controls cache hits instead.
+os.environ.setdefault("TRANSLATION_MEMORY_SIZE", "0")
+
+import main
+
+SCENARIOS = {
+    # name: (endpoint, route)
+    "cloud": ("/translate", "cloud"),
+    "keyword": ("/translate", "keyword"),
+    "ai": ("/translate", "ai"),
+    "keyword-stream": ("/translate/stream", "keyword"),
+    "ai-stream": ("/translate/stream", "ai"),
+}
+BENCHMARK_KEYWORD = "benchmark"
+DICTIONARY_SIZES = (10, 100, 1000, 10000, 100000)
+INPUT_SIZES = (("sentence", 120), ("1kb", 1024), ("10kb", 10 * 1024), ("50kb", 50 * 1024))
+
+# ---------------------------------------------------------------------------
+# Stub backends
+# ---------------------------------------------------------------------------
+
+_BENGALI = {ord(ch): chr(0x0995 + index) for index, ch in enumerate("abcdefghijklmnopqrstuvwxyz")}
+
+def fake_translation(text):
+    """Deterministic stand-in for a translation: latin letters mapped to Bengali ones"""
+    return text.lower().translate(_BENGALI)
+
+class StubError(Exception):
+    pass
+
+class StubQuotaError(StubError):
+    code = 429
+
+class StubBackend:
+    """Latency, failure and chunking behaviour shared by the stub clients"""
+
+    def __init__(self, name, latency_ms, distribution="lognormal", sigma=0.5, error_rate=0.0,
+                 quota_rate=0.0, chunk_chars=40, first_chunk_fraction=0.3, seed=None):
+        self.name = name
+        self.latency = latency_ms / 1000.0
+        self.distribution = distribution
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.chunk_chars = max(chunk_chars, 1)
+        self.first_chunk_fraction = first_chunk_fraction
+        self.random = random.Random(seed)
+        self.stats = {"calls": 0, "errors": 0, "quota_errors": 0}
+        self.lock = threading.Lock()
+
+    def sample_latency(self):
+        if self.latency <= 0:
+            return 0.0
+        if self.distribution == "fixed":
+            return self.latency
+        if self.distribution == "uniform":
+            return self.random.uniform(self.latency * (1 - self.sigma), self.latency * (1 + self.sigma))
+        if self.distribution == "exponential":
+            return self.random.expovariate(1 / self.latency)
+        # lognormal with the configured median
+        return self.random.lognormvariate(0, self.sigma) * self.latency
+
+    def fail(self):
+        """Raise an injected failure, or return normally"""
+        with self.lock:
+            self.stats["calls"] += 1
+            roll = self.random.random()
+            if roll < self.quota_rate:
+                self.stats["quota_errors"] += 1
+            elif roll < self.quota_rate + self.error_rate:
+                self.stats["errors"] += 1
+        if roll < self.quota_rate:
+            raise StubQuotaError(f"429 Resource has been exhausted (stub {self.name})")
+        if roll < self.quota_rate + self.error_rate:
+            raise StubError(f"500 Internal error (stub {self.name})")
+
+    def stream(self, text):
+        """Yield ``text`` in chunks spread over one sampled latency"""
+        latency = self.sample_latency()
+        self.fail()
+        chunks = [text[start:start + self.chunk_chars] for start in range(0, len(text), self.chunk_chars)] or [""]
+        time.sleep(latency * self.first_chunk_fraction)
+        gap = latency * (1 - self.first_chunk_fraction) / max(len(chunks) - 1, 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(gap)
+            yield SimpleNamespace(text=chunk)
+
+class StubGenerativeModel:
+    backend = None  # set by install_stubs
+
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self._client = None  # replaced with a per-key client by GeminiModelPool
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        prompt = contents[0].parts[0]
+        # Keyword prompts carry the instructions inline; translate only the text after them
+        text = prompt.rsplit("Translate the following text to Bengali:", 1)[-1].strip()
+        return self.backend.stream(fake_translation(text))
+
+class StubContent:
+    def __init__(self, role, parts):
+        self.role = role
+        self.parts = parts
+
+class StubPart:
+    @staticmethod
+    def from_text(text):
+        return text
+
+class StubCloudClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def translate_text(self, request):
+        latency = self.backend.sample_latency()
+        self.backend.fail()
+        time.sleep(latency)
+        return SimpleNamespace(translations=[
+            SimpleNamespace(translated_text=fake_translation(text)) for text in request["contents"]
+        ])
+
+def install_stubs(gemini_backend, cloud_backend, keys):
+    """Point main's lazy SDK loaders at the stub backends"""
+    model_class = type("StubGenerativeModel", (StubGenerativeModel,), {"backend": gemini_backend})
+    genai = SimpleNamespace(GenerativeModel=model_class)
+    types = SimpleNamespace(Content=StubContent, Part=StubPart, GenerationConfig=lambda **kwargs: None)
+    cloud_client = StubCloudClient(cloud_backend)
+    main.get_genai = lambda: genai
+    main.get_types = lambda: types
+    main.get_glm = lambda: SimpleNamespace(GenerativeServiceClient=lambda client_options: SimpleNamespace(**client_options))
+    main.get_google_cloud_client = lambda: cloud_client
+    settings = main.dictionaries_cache["settings"]
+    settings["current_api_key"] = keys[0]
+    settings["api_keys"] = list(keys[1:])
+
+# ---------------------------------------------------------------------------
+# In-process ASGI driver
+# ---------------------------------------------------------------------------
+
+async def asgi_request(app, method, path, payload=None):
+    """Send one request straight to the ASGI app; returns status, body and timings in seconds"""
+    body = json.dumps(payload).encode() if payload is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    request_sent = False
+    disconnected = asyncio.get_running_loop().create_future()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected
+        return {"type": "http.disconnect"}
+
+    response = {"status": None, "first_byte": None, "body": []}
+    started = time.perf_counter()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if chunk:
+                if response["first_byte"] is None:
+                    response["first_byte"] = time.perf_counter() - started
+                response["body"].append(chunk)
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        if not disconnected.done():
+            disconnected.set_result(None)
+    total = time.perf_counter() - started
+    return response["status"], b"".join(response["body"]), response["first_byte"] or total, total
+
+# ---------------------------------------------------------------------------
+# Load benchmark
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def summarize_ms(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "mean": round(sum(values) / len(values) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+async def configure_route(route):
+    """Set up settings and dictionaries so requests take the scenario's upstream route"""
+    dictionaries = main.dictionaries_cache
+    dictionaries["settings"]["ai_mode_enabled"] = route == "ai"
+    dictionaries["gemini_keyword_prompts"].pop(BENCHMARK_KEYWORD, None)
+    if route in ("keyword", "ai"):
+        dictionaries["gemini_keyword_prompts"][BENCHMARK_KEYWORD] = {
+            "prompt": "Keep technical terms in English.", "enabled": True
+        }
+    await main.bump_dictionary_version()
+
+def request_text(index, hot_fraction, rng):
+    if hot_fraction and rng.random() < hot_fraction:
+        index = rng.randrange(16)
+        return f"Hot {BENCHMARK_KEYWORD} sentence number {index}: the quick brown fox jumps over the lazy dog."
+    return f"Request {index} of the {BENCHMARK_KEYWORD}: the quick brown fox jumps over the lazy dog near the river bank."
+
+def stream_failed(body):
+    for line in body.splitlines():
+        if line and json.loads(line).get("type") == "error":
+            return True
+    return False
+
+async def run_scenario(name, args, gemini_backend, cloud_backend):
+    endpoint, route = SCENARIOS[name]
+    await configure_route(route)
+    main.translation_cache.clear()
+    main.latency_histograms["gemini"] = main.LatencyHistogram()
+    main.latency_histograms["cloud"] = main.LatencyHistogram()
+    gemini_before = dict(gemini_backend.stats)
+    cloud_before = dict(cloud_backend.stats)
+    rng = random.Random(args.seed)
+    texts = [request_text(index, args.hot_fraction, rng) for index in range(args.requests + args.warmup)]
+
+    async def send(text):
+        payload = {"text": text, "original_english_text": text}
+        if args.deadline_ms:
+            payload["deadline_ms"] = args.deadline_ms
+        return await asgi_request(main.app, "POST", endpoint, payload)
+
+    # Warm-up fills the model pool and hedge histogram before measuring
+    await asyncio.gather(*(send(text) for text in texts[:args.warmup]))
+
+    latencies = []
+    first_bytes = []
+    statuses = {}
+    next_index = iter(range(args.warmup, len(texts)))
+
+    async def worker():
+        for index in next_index:
+            status, body, first_byte, total = await send(texts[index])
+            if status == 200 and endpoint.endswith("/stream") and stream_failed(body):
+                status = "stream_error"
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            latencies.append(total)
+            first_bytes.append(first_byte)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    duration = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "endpoint": endpoint,
+        "route": route,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(args.requests / duration, 2) if duration else None,
+        "success_rate": round(statuses.get("200", 0) / args.requests, 4) if args.requests else None,
+        "status_counts": statuses,
+        "latency_ms": summarize_ms(latencies),
+        "first_byte_ms": summarize_ms(first_bytes),
+        "upstream_calls": {
+            "gemini": {key: gemini_backend.stats[key] - gemini_before[key] for key in gemini_backend.stats},
+            "cloud": {key: cloud_backend.stats[key] - cloud_before[key] for key in cloud_backend.stats},
+        },
+        "cache": main.translation_cache.snapshot(),
+    }
+
+async def load_benchmark(args):
+    gemini_backend = StubBackend(
+        "gemini", args.gemini_latency_ms, args.latency_distribution, args.latency_sigma,
+        args.error_rate, args.quota_rate, args.chunk_chars, args.first_chunk_fraction, args.seed,
+    )
+    cloud_backend = StubBackend(
+        "cloud", args.cloud_latency_ms, args.latency_distribution, args.latency_sigma,
+        args.cloud_error_rate, 0.0, seed=args.seed,
+    )
+    install_stubs(gemini_backend, cloud_backend, [f"benchmark-key-{index:02d}" for index in range(max(args.keys, 1))])
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        result = await run_scenario(name, args, gemini_backend, cloud_backend)
+        latency = result["latency_ms"] or {}
+        print(
+            f"{name:>15}: {result['throughput_rps']} req/s, p50 {latency.get('p50')} ms, "
+            f"p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, statuses {result['status_counts']}",
+            file=sys.stderr,
+        )
+        results.append(result)
+    return results
+
+# ---------------------------------------------------------------------------
+# Dictionary microbenchmarks
+# ---------------------------------------------------------------------------
+
+def make_vocabulary(count, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(4, 10))))
+    return sorted(words)
+
+def make_dictionaries(size, rng):
+    """``size`` entries split over word_replacement (1/2), single_word (1/4) and keyword_based (1/4)"""
+    vocabulary = make_vocabulary(size, rng)
+    dictionaries = {"word_replacement": {}, "single_word": {}, "keyword_based": {}, "gemini_keyword_prompts": {}}
+    for index, word in enumerate(vocabulary):
+        bengali = fake_translation(word)
+        if index % 4 in (0, 1):
+            dictionaries["word_replacement"][bengali] = {"value": bengali + "র", "enabled": True}
+        elif index % 4 == 2:
+            dictionaries["single_word"][bengali] = {"value": bengali + "ে", "enabled": True}
+        else:
+            dictionaries["keyword_based"][word] = {"original": bengali, "replacement": bengali + "া", "enabled": True}
+    return dictionaries, vocabulary
+
+def make_input(size_bytes, vocabulary, hit_rate, rng):
+    """English text of about ``size_bytes`` and its stub translation, ``hit_rate`` of the words in the dictionary"""
+    filler = make_vocabulary(200, random.Random(0))
+    words = []
+    length = 0
+    while length < size_bytes:
+        word = rng.choice(vocabulary) if rng.random() < hit_rate else rng.choice(filler)
+        words.append(word)
+        length += len(word) + 1
+        if len(words) % 12 == 0:
+            words[-1] += "."
+    english = " ".join(words)
+    return english, fake_translation(english)
+
+def time_calls(func, min_time, min_runs=3):
+    """Run ``func`` until ``min_time`` seconds have passed (at least ``min_runs`` times); per-call seconds"""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_runs or time.perf_counter() - started < min_time:
+        call_started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - call_started)
+    return sorted(samples)
+
+def dictionary_benchmark(args):
+    rng = random.Random(args.seed)
+    sizes = [size for size in DICTIONARY_SIZES if size <= args.max_entries]
+    original = main.dictionaries_cache
+    results = []
+    try:
+        for size in sizes:
+            dictionaries, vocabulary = make_dictionaries(size, rng)
+            dictionaries["settings"] = original["settings"]
+            main.dictionaries_cache = dictionaries
+            main._compiled_dictionaries = None
+            compile_started = time.perf_counter()
+            main.get_compiled_dictionaries()
+            compile_ms = (time.perf_counter() - compile_started) * 1000
+            for input_name, input_bytes in INPUT_SIZES:
+                english, translated = make_input(input_bytes, vocabulary, args.hit_rate, rng)
+                used = []
+
+                def call():
+                    used[:] = main.apply_dictionaries(translated, main.dictionaries_cache, english)[1]
+
+                samples = time_calls(call, args.min_time)
+                median = percentile(samples, 50)
+                result = {
+                    "entries": size,
+                    "input": input_name,
+                    "input_bytes": len(english.encode()),
+                    "translated_bytes": len(translated.encode()),
+                    "compile_ms": round(compile_ms, 3),
+                    "runs": len(samples),
+                    "apply_ms": {
+                        "p50": round(median * 1000, 4),
+                        "p95": round(percentile(samples, 95) * 1000, 4),
+                        "min": round(samples[0] * 1000, 4),
+                    },
+                    "throughput_mb_s": round(len(translated.encode()) / median / 1e6, 2) if median else None,
+                    "entries_applied": len(used),
+                }
+                print(
+                    f"{size:>7} entries, {input_name:>8}: {result['apply_ms']['p50']} ms "
+                    f"({result['throughput_mb_s']} MB/s), compile {result['compile_ms']} ms",
+                    file=sys.stderr,
+                )
+                results.append(result)
+    finally:
+        main.dictionaries_cache = original
+        main._compiled_dictionaries = None
+    return results
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=main.BASE_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with stub translation backends")
+    parser.add_argument("suite", choices=("load", "dictionaries", "all"), nargs="?", default="all")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--seed", type=int, default=1234)
+
+    load = parser.add_argument_group("load benchmark")
+    load.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Repeatable; default all")
+    load.add_argument("--requests", type=int, default=500)
+    load.add_argument("--concurrency", type=int, default=32)
+    load.add_argument("--warmup", type=int, default=20)
+    load.add_argument("--hot-fraction", type=float, default=0.0, help="Share of requests drawn from 16 repeated texts")
+    load.add_argument("--deadline-ms", type=int, help="deadline_ms sent with each request")
+    load.add_argument("--keys", type=int, default=1, help="Stub Gemini API keys to spread calls over")
+    load.add_argument("--gemini-latency-ms", type=float, default=600.0, help="Median stub Gemini latency")
+    load.add_argument("--cloud-latency-ms", type=float, default=150.0, help="Median stub Cloud Translation latency")
+    load.add_argument("--latency-distribution", choices=("fixed", "uniform", "lognormal", "exponential"), default="lognormal")
+    load.add_argument("--latency-sigma", type=float, default=0.5, help="Spread of the lognormal/uniform distribution")
+    load.add_argument("--chunk-chars", type=int, default=40, help="Characters per streamed Gemini chunk")
+    load.add_argument("--first-chunk-fraction", type=float, default=0.3, help="Share of the latency before the first chunk")
+    load.add_argument("--error-rate", type=float, default=0.0, help="Share of Gemini calls failing with a 500")
+    load.add_argument("--quota-rate", type=float, default=0.0, help="Share of Gemini calls failing with a 429")
+    load.add_argument("--cloud-error-rate", type=float, default=0.0)
+
+    dictionaries = parser.add_argument_group("dictionary benchmark")
+    dictionaries.add_argument("--max-entries", type=int, default=100000)
+    dictionaries.add_argument("--hit-rate", type=float, default=0.05, help="Share of input words found in the dictionary")
+    dictionaries.add_argument("--min-time", type=float, default=0.2, help="Seconds spent per measurement")
+    return parser.parse_args(argv)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "upstream_pool_size": main.UPSTREAM_POOL_SIZE,
+            "upstream_max_queue": main.UPSTREAM_MAX_QUEUE,
+            "hedge_enabled": main.HEDGE_ENABLED,
+            "args": vars(args),
+        }
+    }
+    if args.suite in ("load", "all"):
+        report["load"] = asyncio.run(load_benchmark(args))
+    if args.suite in ("dictionaries", "all"):
+        report["dictionaries"] = dictionary_benchmark(args)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,18 +1,51 @@
 import os
 import json
 import time
+import asyncio
+import uuid
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import csv
+import io
+import codecs
+import random
+import logging
+import logging.handlers
+import contextvars
+import gzip
+import mimetypes
+import zlib
+import tempfile
+import ipaddress
+from array import array
+from queue import SimpleQueue
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Optional
-from fastapi import FastAPI, Request, Form, HTTPException
+from fastapi import FastAPI, Request, Form, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse, Response
 from pydantic import BaseModel
 import re
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import MutableHeaders
 
 # Get the absolute path of the directory containing main.py
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # not available on Windows; jobs are then not locked between workers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # optional; static files and JSON responses are then gzip-only
+
 # Load environment variables safely
 try:
     from dotenv import load_dotenv
@@ -27,18 +60,6 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Enable CORS for the translation extension
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Mount static files with absolute path
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
-
 # Templates with absolute path
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
@@ -49,11 +70,277 @@ PROJECT_ID = os.environ.get("PROJECT_ID", "534521643480")
 LOCATION = os.environ.get("LOCATION", "us-central1")
 GOOGLE_CLOUD_MODEL = os.environ.get("GOOGLE_CLOUD_MODEL", "projects/534521643480/locations/us-central1/models/NM3ad0dd20ffa743ba")
 
+# Upstream concurrency limits
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "16"))
+UPSTREAM_MAX_QUEUE = int(os.environ.get("UPSTREAM_MAX_QUEUE", "64"))
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "30"))
+# Admission control in front of upstream calls: global in-flight cap, weighted priority lanes, per-client limits
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", str(UPSTREAM_POOL_SIZE)))
+ADMISSION_INTERACTIVE_WEIGHT = int(os.environ.get("ADMISSION_INTERACTIVE_WEIGHT", "4"))
+ADMISSION_BULK_WEIGHT = int(os.environ.get("ADMISSION_BULK_WEIGHT", "1"))
+ADMISSION_INTERACTIVE_QUEUE = int(os.environ.get("ADMISSION_INTERACTIVE_QUEUE", "64"))
+ADMISSION_BULK_QUEUE = int(os.environ.get("ADMISSION_BULK_QUEUE", "256"))
+ADMISSION_INTERACTIVE_TIMEOUT = float(os.environ.get("ADMISSION_INTERACTIVE_TIMEOUT", "10"))
+ADMISSION_BULK_TIMEOUT = float(os.environ.get("ADMISSION_BULK_TIMEOUT", "60"))
+CLIENT_MAX_CONCURRENCY = int(os.environ.get("CLIENT_MAX_CONCURRENCY", "8"))  # 0 = unlimited
+CLIENT_RPM = float(os.environ.get("CLIENT_RPM", "300"))  # 0 = unlimited
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "false").lower() in ("1", "true", "yes")
+# Comma-separated client API tokens (or sha256 hex digests of them) that get their own per-client budget
+CLIENT_API_TOKENS = os.environ.get("CLIENT_API_TOKENS", "")
+# CF-Connecting-IP is always trusted from these peers (Cloudflare's published edge ranges by default)
+CLOUDFLARE_IP_RANGES = os.environ.get("CLOUDFLARE_IP_RANGES", ",".join([
+    "173.245.48.0/20", "103.21.244.0/22", "103.22.200.0/22", "103.31.4.0/22", "141.101.64.0/18",
+    "108.162.192.0/18", "190.93.240.0/20", "188.114.96.0/20", "197.234.240.0/22", "198.41.128.0/17",
+    "162.158.0.0/15", "104.16.0.0/13", "104.24.0.0/14", "172.64.0.0/13", "131.0.72.0/22",
+    "2400:cb00::/32", "2606:4700::/32", "2803:f800::/32", "2405:b500::/32", "2405:8100::/32",
+    "2a06:98c0::/29", "2c0f:f248::/32",
+]))
+# Hedged requests: per-request latency budget and when to send the backup request
+TRANSLATION_DEADLINE = float(os.environ.get("TRANSLATION_DEADLINE", "0"))  # seconds, 0 = UPSTREAM_TIMEOUT
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.25"))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "1.0"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+GEMINI_MODEL_POOL_SIZE = int(os.environ.get("GEMINI_MODEL_POOL_SIZE", "32"))
+
+# Per-key Gemini rate limits used by the API key scheduler
+GEMINI_KEY_RPM = float(os.environ.get("GEMINI_KEY_RPM", "60"))
+GEMINI_KEY_TPM = float(os.environ.get("GEMINI_KEY_TPM", "1000000"))
+GEMINI_KEY_COOLDOWN = float(os.environ.get("GEMINI_KEY_COOLDOWN", "60"))
+GEMINI_KEY_MAX_COOLDOWN = float(os.environ.get("GEMINI_KEY_MAX_COOLDOWN", "600"))
+GEMINI_KEY_INVALID_COOLDOWN = float(os.environ.get("GEMINI_KEY_INVALID_COOLDOWN", "3600"))
+
+# Translation result cache
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", "2048"))
+TRANSLATION_CACHE_TTL = float(os.environ.get("TRANSLATION_CACHE_TTL", "86400"))
+TRANSLATION_CACHE_PATH = os.environ.get("TRANSLATION_CACHE_PATH")
+TRANSLATION_CACHE_DISK_SIZE = int(os.environ.get("TRANSLATION_CACHE_DISK_SIZE", "100000"))
+TRANSLATION_CACHE_FLUSH_INTERVAL = float(os.environ.get("TRANSLATION_CACHE_FLUSH_INTERVAL", "2.0"))
+
+# Fuzzy translation memory: reuse or reference translations of near-duplicate source texts
+TRANSLATION_MEMORY_SIZE = int(os.environ.get("TRANSLATION_MEMORY_SIZE", "20000"))  # 0 = disabled
+TRANSLATION_MEMORY_PATH = os.environ.get("TRANSLATION_MEMORY_PATH", os.path.join(BASE_DIR, "translation_memory.db"))
+TRANSLATION_MEMORY_THRESHOLD = float(os.environ.get("TRANSLATION_MEMORY_THRESHOLD", "0.6"))
+TRANSLATION_MEMORY_MAX_CHARS = int(os.environ.get("TRANSLATION_MEMORY_MAX_CHARS", "1000"))
+TRANSLATION_MEMORY_FLUSH_INTERVAL = float(os.environ.get("TRANSLATION_MEMORY_FLUSH_INTERVAL", "2.0"))
+
+# Batch translation packing budgets (per upstream request)
+BATCH_MAX_CHARS = int(os.environ.get("BATCH_MAX_CHARS", "20000"))
+BATCH_MAX_SEGMENTS = int(os.environ.get("BATCH_MAX_SEGMENTS", "128"))
+
+# Incremental (segment-level) translation sessions for the live editor
+SEGMENT_SESSIONS_MAX = int(os.environ.get("SEGMENT_SESSIONS_MAX", "1000"))
+SEGMENT_SESSION_TTL = float(os.environ.get("SEGMENT_SESSION_TTL", "3600"))
+
+# Background document translation jobs
+JOBS_DIR = os.environ.get("JOBS_DIR", os.path.join(BASE_DIR, "jobs"))
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "4"))
+JOB_CHUNK_CHARS = int(os.environ.get("JOB_CHUNK_CHARS", "4000"))
+JOB_CHUNK_UNITS = int(os.environ.get("JOB_CHUNK_UNITS", "50"))
+JOB_CHUNK_RETRIES = int(os.environ.get("JOB_CHUNK_RETRIES", "3"))
+JOB_MAX_BYTES = int(os.environ.get("JOB_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Dictionary store shared by all workers ("sqlite" or "memory")
+DICTIONARY_STORE = os.environ.get("DICTIONARY_STORE", "sqlite").lower()
+DICTIONARY_STORE_PATH = os.environ.get("DICTIONARY_STORE_PATH", os.path.join(BASE_DIR, "dictionaries.db"))
+DICTIONARY_SYNC_INTERVAL = float(os.environ.get("DICTIONARY_SYNC_INTERVAL", "1.0"))
+DICTIONARY_IMPORT_MAX_BYTES = int(os.environ.get("DICTIONARY_IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Dictionaries up to this many entries of a kind are applied with regex / substring scans instead of the trie
+DICTIONARY_SCAN_MAX_ENTRIES = int(os.environ.get("DICTIONARY_SCAN_MAX_ENTRIES", "256"))
+
+# Observability: fraction of routine (info) log events written, Server-Timing header on responses
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))
+SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Static assets (content-hashed, precompressed) and compression of large JSON responses
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+
+# Startup: warm SDK imports, clients and the default Gemini models in the background; /ready reports when done
+PREWARM_ON_STARTUP = os.environ.get("PREWARM_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+_startup_started = time.perf_counter()
+_startup_lock = threading.Lock()
+startup_state = {"prewarm": PREWARM_ON_STARTUP, "finished": False, "ready_after_ms": None, "phases": {}}
+
+def record_startup_phase(name, seconds, status="ok", detail=None):
+    """Record how long one import / initialization step of startup took and how it ended"""
+    phase = {"ms": round(seconds * 1000, 2), "status": status}
+    if detail:
+        phase["detail"] = detail
+    with _startup_lock:
+        startup_state["phases"][name] = phase
+    print(f"INFO: Startup phase {name}: {status} in {phase['ms']} ms")
+
+def run_startup_phase(name, func):
+    """Time ``func`` as a startup phase; it returns the phase status ("ok", "skipped", "unavailable")"""
+    started = time.perf_counter()
+    try:
+        status = func() or "ok"
+    except Exception as e:
+        record_startup_phase(name, time.perf_counter() - started, "failed", str(e))
+        return
+    record_startup_phase(name, time.perf_counter() - started, status)
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+def accepted_encoding(accept_encoding):
+    """Best content coding the client accepts: "br" (when brotli is installed), "gzip" or None"""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def compress_body(body, coding, best=False):
+    """Compress with the given coding; ``best`` trades CPU for size when the result is reused"""
+    if coding == "br":
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+
+def compressed_variants(body, media_type):
+    """Identity body plus the precompressed encodings that actually come out smaller"""
+    variants = {"identity": body}
+    if len(body) < COMPRESSION_MIN_BYTES or not media_type.startswith(COMPRESSIBLE_TYPES):
+        return variants
+    for coding in ("gzip", "br") if brotli is not None else ("gzip",):
+        compressed = compress_body(body, coding, best=True)
+        if len(compressed) < len(body):
+            variants[coding] = compressed
+    return variants
+
+def variant_response(request, variants, media_type, etag, cache_control):
+    """Serve the best precompressed variant the client accepts, or 304 when its ETag is current"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if len(variants) > 1:
+        headers["Vary"] = "Accept-Encoding"
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    coding = accepted_encoding(request.headers.get("accept-encoding"))
+    if coding not in variants:
+        coding = "gzip" if coding == "br" and "gzip" in variants else "identity"
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+    body = variants[coding]
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(len(body))
+        body = b""
+    return Response(body, headers=headers, media_type=media_type)
+
+class StaticAssets:
+    """Serves /static from memory with content-hashed URLs and precompressed gzip/brotli variants.
+
+    ``url("script.js")`` gives ``/static/script.<hash>.js``, which is served
+    with an immutable one-year Cache-Control; the plain name still works but
+    must be revalidated. Files are read once at startup, anything else falls
+    through to StaticFiles.
+    """
+
+    def __init__(self, directory):
+        self.files = StaticFiles(directory=directory)
+        self.assets = {}
+        self.urls = {}
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:12]
+            stem, extension = os.path.splitext(name)
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            asset = {"variants": compressed_variants(body, media_type), "media_type": media_type, "etag": f'"{digest}"'}
+            self.assets[name] = {**asset, "cache_control": "no-cache"}
+            self.assets[f"{stem}.{digest}{extension}"] = {**asset, "cache_control": "public, max-age=31536000, immutable"}
+            self.urls[name] = f"/static/{stem}.{digest}{extension}"
+
+    def url(self, name):
+        return self.urls.get(name, f"/static/{name}")
+
+    async def __call__(self, scope, receive, send):
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        asset = self.assets.get(path.lstrip("/"))
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await self.files(scope, receive, send)
+        response = variant_response(Request(scope), asset["variants"], asset["media_type"], asset["etag"], asset["cache_control"])
+        await response(scope, receive, send)
+
+_phase_started = time.perf_counter()
+static_assets = StaticAssets(STATIC_DIR)
+app.mount("/static", static_assets, name="static")
+templates.env.globals["static_url"] = static_assets.url
+record_startup_phase("load_static_assets", time.perf_counter() - _phase_started)
+
+class CompressionMiddleware:
+    """Compresses complete JSON responses of at least COMPRESSION_MIN_BYTES with brotli or gzip.
+
+    Streaming responses (NDJSON, exports) pass through untouched so chunks
+    still reach the client as soon as they are produced.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        coding = None
+        for name, value in scope.get("headers", []):
+            if name.lower() == b"accept-encoding":
+                coding = accepted_encoding(value.decode("latin-1"))
+        if coding is None:
+            return await self.app(scope, receive, send)
+        state = {"start": None, "passthrough": False}
+
+        async def send_compressed(message):
+            if state["passthrough"]:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            start, state["passthrough"] = state["start"], True
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if (message.get("more_body", False) or len(body) < COMPRESSION_MIN_BYTES or "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith("application/json")):
+                await send(start)
+                return await send(message)
+            if len(body) > 256 * 1024:
+                body = await asyncio.get_running_loop().run_in_executor(None, compress_body, body, coding)
+            else:
+                body = compress_body(body, coding)
+            headers["Content-Encoding"] = coding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag  # the compressed bytes differ from the identity representation
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
 # Lazy loading for heavy dependencies
 _genai = None
 _translate = None
 _service_account = None
 _types = None
+_glm = None
 
 def get_genai():
     """Lazy load Google Generative AI"""
@@ -103,6 +390,18 @@ def get_types():
             _types = False
     return _types if _types is not False else None
 
+def get_glm():
+    """Lazy load the Generative Language API client library used for per-key Gemini clients"""
+    global _glm
+    if _glm is None:
+        try:
+            import google.ai.generativelanguage as glm
+            _glm = glm
+        except ImportError as e:
+            print(f"WARNING: Could not import google.ai.generativelanguage: {e}")
+            _glm = False
+    return _glm if _glm is not False else None
+
 # Initialize Google Cloud Translation client (lazy initialization)
 client = None
 
@@ -136,7 +435,9 @@ def get_google_cloud_client():
         credentials = service_account.Credentials.from_service_account_info(credentials_data)
         
         # Initialize client with credentials object
+        setup_started = time.perf_counter()
         client = translate.TranslationServiceClient(credentials=credentials)
+        record_stage("client_setup", time.perf_counter() - setup_started, backend="cloud")
         print("INFO: Google Cloud Translation client initialized successfully with in-memory credentials")
         return client
     except Exception as e:
@@ -145,357 +446,3758 @@ def get_google_cloud_client():
 
 parent = f"projects/{PROJECT_ID}/locations/{LOCATION}"
 
-# Default configuration
-DEFAULT_DICTIONARIES = {
-    "word_replacement": {},
-    "keyword_based": {},
-    "single_word": {},
-    "gemini_keyword_prompts": {},
-    "settings": {
-        "ai_mode_enabled": False,
-        "api_keys": [],
-        "model_names": [],
-        "current_api_key": GEMINI_API_KEY or "",
-        "current_model_name": "gemini-2.5-flash-preview-05-20"
-    }
-}
-
-DEFAULT_GENERAL_PROMPT = "You are an experienced English to Bengali translator. You will translate the provided text into fluent and accurate bengali. Do not output anything other than the translation."
-
-# In-memory storage (for demo purposes - in production, use a database)
-dictionaries_cache = DEFAULT_DICTIONARIES.copy()
-general_prompt_cache = DEFAULT_GENERAL_PROMPT
+# Bounded executor for blocking upstream calls (Gemini / Cloud Translation)
+_upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix="upstream")
+_upstream_lock = threading.Lock()
+_upstream_pending = 0
 
-def apply_dictionaries(text, dictionaries, original_english_text):
-    used_entries = []
-    
-    # Apply keyword-based replacements (sorted by length)
-    keyword_based = dictionaries.get("keyword_based", {})
-    sorted_keywords = sorted(keyword_based.keys(), key=len, reverse=True)
-    for keyword in sorted_keywords:
-        entry = keyword_based[keyword]
-        if not entry.get("enabled", True):
-            continue
-        original_bengali = entry.get("original")
-        replacement_bengali = entry.get("replacement")
-        
-        # Check if the English keyword is in the original English text
-        if keyword.lower() in original_english_text.lower():
-            if original_bengali and replacement_bengali and original_bengali in text:
-                highlighted = f'<span style="color:red">{replacement_bengali}</span>'
-                text = text.replace(original_bengali, highlighted)
-                used_entries.append({"type": "keyword_based", "key": keyword, "original": original_bengali, "replacement": replacement_bengali})
-
-    # Apply word-replacement and single-word replacements
-    word_replacements = dictionaries.get("word_replacement", {})
-    single_word_replacements = dictionaries.get("single_word", {})
-    enabled_word_repl = {key: val.get("value") for key, val in word_replacements.items() if val.get("enabled", True)}
-    enabled_single_repl = {key: val.get("value") for key, val in single_word_replacements.items() if val.get("enabled", True)}
-    all_word_replacements = {**enabled_word_repl, **enabled_single_repl}
-
-    # Create a regex pattern for whole word matching
-    sorted_keys = sorted(all_word_replacements.keys(), key=len, reverse=True)
-    escaped_keys = [re.escape(key) for key in sorted_keys]
-    if escaped_keys:
-        pattern = r'\b(' + '|'.join(escaped_keys) + r')\b'
-
-        def replace_word(match):
-            orig = match.group(0)
-            repl = all_word_replacements.get(orig, orig)
-            if repl != orig:
-                used_entries.append({"type": "word_replacement/single_word", "key": orig, "original": orig, "replacement": repl})
-                return f'<span style="color:red">{repl}</span>'
-            return repl
+def _acquire_upstream_slot():
+    global _upstream_pending
+    with _upstream_lock:
+        if _upstream_pending >= UPSTREAM_POOL_SIZE + UPSTREAM_MAX_QUEUE:
+            raise HTTPException(status_code=503, detail="Translation service is busy, please retry shortly.")
+        _upstream_pending += 1
 
-        text = re.sub(pattern, replace_word, text)
-    
-    return text, used_entries
+def _release_upstream_slot(_future):
+    global _upstream_pending
+    with _upstream_lock:
+        _upstream_pending -= 1
 
-class TranslationRequest(BaseModel):
-    text: str
-    original_english_text: str
+async def _admit_upstream_call():
+    """Wait for an admission slot in the current request's lane, then take an executor slot.
 
-@app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request):
-    """Root endpoint that serves the main application and acts as a health check"""
+    Returns a done callback for the executor future that gives both back; the
+    admission slot is returned on the event loop once the worker finishes.
+    """
+    await upstream_admission.acquire(_admission_context.get()[1])
     try:
-        return templates.TemplateResponse("index.html", {
-            "request": request,
-            "general_prompt": general_prompt_cache,
-            "ai_mode_enabled": dictionaries_cache["settings"].get("ai_mode_enabled", False),
-            "api_keys": dictionaries_cache["settings"].get("api_keys", []),
-            "model_names": dictionaries_cache["settings"].get("model_names", [])
-        })
-    except Exception as e:
-        print(f"ERROR: Root endpoint error: {e}")
-        # Return a simple HTML response if template fails
-        return HTMLResponse(
-            content="""
-            <html>
-                <head><title>Fast Translation Webapp</title></head>
-                <body>
-                    <h1>Fast Translation Webapp</h1>
-                    <p>Service is running but template loading failed.</p>
-                    <p>Error: """ + str(e) + """</p>
-                </body>
-            </html>
-            """,
-            status_code=200
-        )
+        _acquire_upstream_slot()
+    except HTTPException:
+        upstream_admission.release()
+        raise
+    loop = asyncio.get_running_loop()
 
-@app.post("/translate")
-async def translate_text(translation_request: TranslationRequest):
-    translated_text_raw = ""
-    used_dictionaries = []
-    
-    ai_mode_enabled = dictionaries_cache["settings"].get("ai_mode_enabled", False)
-    current_api_key = dictionaries_cache["settings"].get("current_api_key", GEMINI_API_KEY)
-    current_model_name = dictionaries_cache["settings"].get("current_model_name", "gemini-2.5-flash-preview-05-20")
+    def release(future):
+        _release_upstream_slot(future)
+        try:
+            loop.call_soon_threadsafe(upstream_admission.release)
+        except RuntimeError:
+            pass  # event loop is gone
 
-    if not translation_request.text.strip():
-        raise HTTPException(status_code=400, detail="Input text cannot be empty.")
+    return release
 
-    # Get required modules
-    genai = get_genai()
-    types = get_types()
-    
-    if not genai or not types:
-        raise HTTPException(status_code=500, detail="Translation services not available.")
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds) with approximate percentiles"""
 
-    # Initialize Gemini client with the current API key
-    if current_api_key:
-        genai.configure(api_key=current_api_key)
-    else:
-        raise HTTPException(status_code=400, detail="No Gemini API key configured.")
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0, float("inf"))
 
-    generate_content_config = types.GenerationConfig(
-        response_mime_type="text/plain",
-    )
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.BUCKETS = tuple(buckets) + ((float("inf"),) if buckets[-1] != float("inf") else ())
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
 
-    if ai_mode_enabled:
-        print("INFO: Using Gemini AI Mode for translation.")
-        try:
-            gemini_keyword_prompts = dictionaries_cache.get("gemini_keyword_prompts", {})
-            matched_gemini_keyword = None
-            
-            for keyword, entry in gemini_keyword_prompts.items():
-                if entry.get("enabled", True) and keyword.lower() in translation_request.original_english_text.lower():
-                    matched_gemini_keyword = entry
+    def observe(self, seconds):
+        with self.lock:
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.counts[index] += 1
                     break
+            self.count += 1
+            self.total += seconds
 
-            system_instruction_text = general_prompt_cache
-            if matched_gemini_keyword:
-                keyword_prompt = matched_gemini_keyword.get("prompt", "")
-                system_instruction_text = f"{general_prompt_cache}\n\n{keyword_prompt}"
-                used_dictionaries.append({"type": "gemini_keyword_prompt", "key": matched_gemini_keyword.get("keyword"), "prompt": keyword_prompt})
-            else:
-                used_dictionaries.append({"type": "gemini_ai_mode", "prompt": general_prompt_cache})
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile, or None without samples"""
+        with self.lock:
+            if not self.count:
+                return None
+            rank = self.count * percent / 100.0
+            seen = 0
+            for index, bound in enumerate(self.BUCKETS):
+                seen += self.counts[index]
+                if seen >= rank:
+                    return bound if bound != float("inf") else self.BUCKETS[-2]
+        return None
 
-            # Use GenerativeModel with system_instruction for AI mode
-            model_gemini = genai.GenerativeModel(current_model_name, system_instruction=system_instruction_text)
-            
-            # Send the user's text as content
-            response_stream = model_gemini.generate_content(
-                contents=[types.Content(role="user", parts=[types.Part.from_text(text=translation_request.text)])],
-                generation_config=generate_content_config,
-                stream=True
-            )
-            translated_text_raw = "".join(chunk.text for chunk in response_stream)
-            
-        except Exception as e:
-            print(f"Gemini AI Mode translation error: {e}")
-            raise HTTPException(status_code=500, detail="An error occurred during AI Mode translation with Gemini.")
-    else:
-        # Existing logic for non-AI mode (keyword-based Gemini or Google Cloud Translation)
-        gemini_keyword_prompts = dictionaries_cache.get("gemini_keyword_prompts", {})
-        matched_gemini_keyword = None
-        for keyword, entry in gemini_keyword_prompts.items():
-            if entry.get("enabled", True) and keyword.lower() in translation_request.original_english_text.lower():
-                matched_gemini_keyword = entry
-                break
+    def snapshot(self):
+        with self.lock:
+            return {"count": self.count, "sum": round(self.total, 4), "buckets": dict(zip(self.BUCKETS, self.counts))}
 
-        if matched_gemini_keyword:
-            print("INFO: Using Gemini Keyword Prompt for translation.")
+# End-to-end upstream latency (queue wait included) per backend, feeds the hedge thresholds
+latency_histograms = {"gemini": LatencyHistogram(), "cloud": LatencyHistogram()}
+
+# Structured request logging: JSON lines handed to a background thread so the event loop never blocks on stdout
+_log_queue = SimpleQueue()
+translation_logger = logging.getLogger("fast_translation")
+translation_logger.setLevel(logging.INFO)
+translation_logger.propagate = False
+translation_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+_LOG_LEVELS = {"info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+def log_event(event, level="info", **fields):
+    """Log one JSON line; info events are sampled at LOG_SAMPLE_RATE, warnings and errors always kept"""
+    if level == "info" and LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE:
+        return
+    record = {"ts": round(time.time(), 3), "level": level, "event": event, **fields}
+    translation_logger.log(_LOG_LEVELS.get(level, logging.INFO), json.dumps(record, ensure_ascii=False, default=str))
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def _prometheus_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """Labeled counters and histograms rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = OrderedDict()  # name -> {"kind", "help", "buckets", "series"}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self.metrics[name] = {"kind": "counter", "help": help_text, "series": {}}
+
+    def histogram(self, name, help_text, buckets=None):
+        self.metrics[name] = {"kind": "histogram", "help": help_text, "buckets": buckets, "series": {}}
+
+    def collector(self, func):
+        """Register ``func() -> [(name, kind, help, [(labels_dict, value), ...]), ...]`` evaluated at scrape time"""
+        self.collectors.append(func)
+        return func
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.metrics[name]["series"]
+        with self.lock:
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        metric = self.metrics[name]
+        histogram = metric["series"].get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = metric["series"].setdefault(key, LatencyHistogram(metric["buckets"]))
+        histogram.observe(value)
+
+    def render(self):
+        lines = []
+        for name, metric in list(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            with self.lock:
+                series = list(metric["series"].items())
+            for key, value in series:
+                if metric["kind"] == "counter":
+                    lines.append(f"{name}{_prometheus_labels(key)} {_prometheus_number(value)}")
+                    continue
+                snapshot = value.snapshot()
+                cumulative = 0
+                for bound, count in snapshot["buckets"].items():
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_prometheus_labels(key + (('le', _prometheus_number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_prometheus_labels(key)} {snapshot['sum']}")
+                lines.append(f"{name}_count{_prometheus_labels(key)} {snapshot['count']}")
+        for collect in self.collectors:
             try:
-                keyword_prompt = matched_gemini_keyword.get("prompt", "")
-                full_prompt = f"{general_prompt_cache}\n\n{keyword_prompt}\n\nTranslate the following text to Bengali: {translation_request.text}"
-                
-                # For keyword-based, use the full_prompt as content, not system_instruction
-                model_gemini = genai.GenerativeModel(current_model_name)
-                response_stream = model_gemini.generate_content(
-                    contents=[types.Content(role="user", parts=[types.Part.from_text(text=full_prompt)])],
-                    generation_config=generate_content_config,
-                    stream=True
-                )
-                translated_text_raw = "".join(chunk.text for chunk in response_stream)
-                used_dictionaries.append({"type": "gemini_keyword_prompt", "key": matched_gemini_keyword.get("keyword"), "prompt": keyword_prompt})
+                families = collect()
             except Exception as e:
-                print(f"Gemini translation error: {e}")
-                # Fallback to Google Cloud Translation if Gemini fails
-                fallback_client = get_google_cloud_client()
-                if fallback_client:
-                    try:
-                        print("INFO: Falling back to Google Cloud Translation API.")
-                        response = fallback_client.translate_text(
-                            request={
-                                "parent": parent,
-                                "contents": [translation_request.text],
-                                "mime_type": "text/plain",
-                                "source_language_code": "en-US",
-                                "target_language_code": "bn",
-                                "model": GOOGLE_CLOUD_MODEL,
-                            }
-                        )
-                        translated_text_raw = response.translations[0].translated_text
-                    except Exception as e:
-                        print(f"Translation error (fallback): {e}")
-                        raise HTTPException(status_code=500, detail="An error occurred during translation.")
-                else:
-                    raise HTTPException(status_code=500, detail="Translation service unavailable.")
-        else:
-            translation_client = get_google_cloud_client()
-            if translation_client:
-                print("INFO: Using Google Cloud Translation API for translation.")
-                try:
-                    response = translation_client.translate_text(
-                        request={
-                            "parent": parent,
-                            "contents": [translation_request.text],
-                            "mime_type": "text/plain",
-                            "source_language_code": "en-US",
-                            "target_language_code": "bn",
-                            "model": GOOGLE_CLOUD_MODEL,
-                        }
-                    )
-                    translated_text_raw = response.translations[0].translated_text
-                except Exception as e:
-                    print(f"Translation error: {e}")
-                    raise HTTPException(status_code=500, detail="An error occurred during translation.")
-            else:
-                raise HTTPException(status_code=500, detail="Translation service unavailable.")
+                log_event("metrics_collector_failed", level="warning", collector=collect.__name__, error=str(e))
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_prometheus_labels(sorted(labels.items()))} {_prometheus_number(value)}")
+        return "\n".join(lines) + "\n"
 
-    # Apply dictionaries and get used entries
-    translated_text_with_dicts, applied_dicts = apply_dictionaries(
-        translated_text_raw,
-        dictionaries_cache,
-        translation_request.original_english_text
-    )
-    used_dictionaries.extend(applied_dicts)
-    
-    return {"translation": translated_text_with_dicts, "used_dictionaries": used_dictionaries}
+metrics = MetricsRegistry()
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+metrics.counter("http_requests_total", "HTTP requests by route, method and status")
+metrics.histogram("http_request_duration_seconds", "Time from request start to the last response byte", _STAGE_BUCKETS)
+metrics.histogram("http_response_size_bytes", "Response body size", _SIZE_BUCKETS)
+metrics.histogram("translation_stage_seconds", "Time spent per translation stage", _STAGE_BUCKETS)
+metrics.histogram("upstream_latency_seconds", "Upstream call latency including queue wait, by backend and model", _STAGE_BUCKETS)
+metrics.histogram("upstream_first_chunk_seconds", "Time to the first streamed upstream chunk, by backend and model", _STAGE_BUCKETS)
+metrics.counter("upstream_errors_total", "Failed or timed out upstream calls, by backend and model")
+metrics.counter("websocket_translations_total", "Live-translation channel requests by outcome (completed, cancelled, error)")
 
-@app.get("/dictionaries")
-async def get_dictionaries():
-    return dictionaries_cache
+# Per-request stage timings (ms) reported in the Server-Timing header; None outside a request
+_request_stages = contextvars.ContextVar("request_stages", default=None)
 
-@app.post("/update_dictionary")
-async def update_dictionary(dict_type: str = Form(...), key: str = Form(...), value: str = Form(...)):
-    global dictionaries_cache
-    if dict_type in ["keyword_based", "gemini_keyword_prompts"]:
-        entry = json.loads(value)
-        entry.setdefault("enabled", True)
-        dictionaries_cache[dict_type][key] = entry
-    else:
-        dictionaries_cache[dict_type][key] = {"value": value, "enabled": True}
-    return {"status": "success"}
+def _add_server_timing(stage, seconds):
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds * 1000
 
-@app.delete("/delete_dictionary_entry")
-async def delete_dictionary_entry(dict_type: str = Form(...), key: str = Form(...)):
-    global dictionaries_cache
-    if key in dictionaries_cache[dict_type]:
-        del dictionaries_cache[dict_type][key]
-        return {"status": "success"}
-    return {"status": "error", "message": "Key not found"}
+def record_stage(stage, seconds, **labels):
+    """Record a stage duration in the metrics and in the current request's Server-Timing entries"""
+    metrics.observe("translation_stage_seconds", seconds, stage=stage, **labels)
+    _add_server_timing(stage, seconds)
 
-@app.post("/toggle_dictionary_entry")
-async def toggle_dictionary_entry(dict_type: str = Form(...), key: str = Form(...), enabled: bool = Form(...)):
-    global dictionaries_cache
-    if key in dictionaries_cache.get(dict_type, {}):
-        entry = dictionaries_cache[dict_type]
-        if isinstance(entry, dict):
-            if key in entry:
-                entry[key]["enabled"] = enabled
-                return {"status": "success"}
-        elif dict_type in ["word_replacement", "single_word"]:
-            if key in dictionaries_cache[dict_type]:
-                dictionaries_cache[dict_type][key]["enabled"] = enabled
-                return {"status": "success"}
-    return {"status": "error", "message": "Key not found or invalid dictionary type."}
+def _route_label(scope):
+    """Route template for metrics labels (``/jobs/{job_id}`` instead of every job id)"""
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        for route in app.routes:
+            if getattr(route, "endpoint", None) is endpoint or getattr(route, "app", None) is endpoint:
+                return route.path
+    return "unmatched"
 
-@app.get("/get_general_prompt")
-async def get_general_prompt():
-    return {"prompt": general_prompt_cache}
+class RequestMetricsMiddleware:
+    """Counts requests and response bytes, and reports per-stage timings in a Server-Timing header.
 
-@app.post("/update_general_prompt")
-async def update_general_prompt(prompt: str = Form(...)):
-    global general_prompt_cache
-    general_prompt_cache = prompt
-    return {"status": "success"}
+    A plain ASGI middleware so streaming responses pass through untouched.
+    """
 
-@app.get("/get_ai_mode_status")
-async def get_ai_mode_status():
-    return {"ai_mode_enabled": dictionaries_cache["settings"].get("ai_mode_enabled", False)}
+    def __init__(self, app):
+        self.app = app
 
-@app.post("/toggle_ai_mode")
-async def toggle_ai_mode(enabled: bool = Form(...)):
-    global dictionaries_cache
-    dictionaries_cache["settings"]["ai_mode_enabled"] = enabled
-    return {"status": "success"}
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        stages = {}
+        token = _request_stages.set(stages)
+        response = {"status": 500, "bytes": 0}
 
-@app.post("/save_settings")
-async def save_settings(api_key: str = Form(None), model_name: str = Form(None)):
-    global dictionaries_cache
-    settings = dictionaries_cache.get("settings", {})
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    entries = [f"{name};dur={duration:.1f}" for name, duration in stages.items()]
+                    entries.append(f"total;dur={(time.perf_counter() - started) * 1000:.1f}")
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", ", ".join(entries).encode("latin-1"))]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
 
-    if api_key:
-        if "api_keys" not in settings:
-            settings["api_keys"] = []
-        if api_key not in settings["api_keys"]:
-            settings["api_keys"].insert(0, api_key)
-            settings["api_keys"] = settings["api_keys"][:10]
-        settings["current_api_key"] = api_key
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _request_stages.reset(token)
+            route = _route_label(scope)
+            metrics.inc("http_requests_total", route=route, method=scope["method"], status=response["status"])
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - started, route=route)
+            metrics.observe("http_response_size_bytes", response["bytes"], route=route)
 
-    if model_name:
-        if "model_names" not in settings:
-            settings["model_names"] = []
-        if model_name not in settings["model_names"]:
-            settings["model_names"].insert(0, model_name)
-            settings["model_names"] = settings["model_names"][:10]
-        settings["current_model_name"] = model_name
+# Requests to these endpoints are admitted per client and run in the given priority lane
+ADMISSION_ROUTES = {
+    "/translate": "interactive",
+    "/translate/stream": "interactive",
+    "/translate/segments": "interactive",
+    "/translate/batch": "bulk",
+    "/jobs": "bulk",
+}
+ADMISSION_LANES = ("interactive", "bulk")
 
-    dictionaries_cache["settings"] = settings
-    return {"status": "success"}
+# (client id, lane) of the current request, read by run_upstream / stream_upstream
+_admission_context = contextvars.ContextVar("admission_context", default=(None, "interactive"))
 
-@app.get("/load_settings")
-async def load_settings():
-    settings = dictionaries_cache.get("settings", {})
-    return {
-        "api_keys": settings.get("api_keys", []),
-        "model_names": settings.get("model_names", []),
-        "current_api_key": settings.get("current_api_key", ""),
-        "current_model_name": settings.get("current_model_name", "")
-    }
+_cloudflare_networks = []
+for _cidr in CLOUDFLARE_IP_RANGES.split(","):
+    if _cidr.strip():
+        try:
+            _cloudflare_networks.append(ipaddress.ip_network(_cidr.strip(), strict=False))
+        except ValueError:
+            print(f"Ignoring invalid CLOUDFLARE_IP_RANGES entry: {_cidr.strip()}")
 
-# Health check endpoints for Cloudflare Pages
-@app.get("/health")
-async def health_check():
-    """Fast health check endpoint"""
-    return {
-        "status": "healthy", 
-        "service": "fast-translation-webapp",
-        "version": "1.0.0"
-    }
+def is_cloudflare_peer(peer):
+    """True when the direct peer is a Cloudflare edge, so its CF-Connecting-IP header can be trusted"""
+    try:
+        address = ipaddress.ip_address(peer)
+    except ValueError:
+        return False
+    return any(address in network for network in _cloudflare_networks)
 
-@app.get("/ping")
-async def ping():
-    """Simple ping endpoint for load balancer health checks"""
-    return {"message": "pong"}
+# Known client tokens, stored only as sha256 digests
+_client_token_digests = set()
+for _token in CLIENT_API_TOKENS.split(","):
+    _token = _token.strip()
+    if re.fullmatch(r"[0-9a-fA-F]{64}", _token):
+        _client_token_digests.add(_token.lower())
+    elif _token:
+        _client_token_digests.add(hashlib.sha256(_token.encode()).hexdigest())
 
-# Startup event - keep it minimal for fast startup
-@app.on_event("startup")
-async def startup_event():
-    print("INFO: Fast Translation webapp starting up...")
-    print("INFO: Server ready to accept connections")
+def client_identity(scope):
+    """Client id for per-client limits: a hash of the API token if it is a configured CLIENT_API_TOKENS
+    entry, otherwise the IP (unknown tokens must not let a caller mint fresh budgets)"""
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+    authorization = headers.get("authorization", "")
+    token = authorization[7:].strip() if authorization.lower().startswith("bearer ") else headers.get("x-api-token", "").strip()
+    if token and _client_token_digests:
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        if digest in _client_token_digests:
+            return "token:" + digest[:12]
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    if TRUST_PROXY_HEADERS:
+        forwarded = headers.get("cf-connecting-ip") or headers.get("x-forwarded-for", "").split(",")[0].strip()
+        if forwarded:
+            return "ip:" + forwarded
+    elif headers.get("cf-connecting-ip") and is_cloudflare_peer(peer):
+        return "ip:" + headers["cf-connecting-ip"].strip()
+    return "ip:" + peer
+
+def request_lane(scope, default_lane):
+    """Bulk endpoints always run in the bulk lane; other requests may opt into it with X-Request-Priority"""
+    for name, value in scope.get("headers", []):
+        if name.lower() == b"x-request-priority" and value.decode("latin-1").strip().lower() == "bulk":
+            return "bulk"
+    return default_lane
+
+class AdmissionMiddleware:
+    """Applies per-client limits to translation endpoints and tags the request with its lane.
+
+    Rejections are answered immediately with 429 and Retry-After. WebSocket
+    connections only get their client and lane here; /ws/translate checks
+    the client limits per message.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket" and scope["path"] == "/ws/translate":
+            _admission_context.set((client_identity(scope), request_lane(scope, "interactive")))
+            return await self.app(scope, receive, send)
+        default_lane = ADMISSION_ROUTES.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if default_lane is None:
+            return await self.app(scope, receive, send)
+
+        client = client_identity(scope)
+        try:
+            client_limiter.enter(client)
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            return await response(scope, receive, send)
+        token = _admission_context.set((client, request_lane(scope, default_lane)))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _admission_context.reset(token)
+            client_limiter.exit(client)
+
+# Outermost last: metrics see every (compressed) response, and admission 429s still get CORS headers
+app.add_middleware(AdmissionMiddleware)
+
+# Enable CORS for the translation extension
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
+def _upstream_model_label(backend, model):
+    if model:
+        return model
+    if backend and backend.startswith("cloud"):
+        return GOOGLE_CLOUD_MODEL.rsplit("/", 1)[-1]
+    return "unknown"
+
+def _observe_backend_latency(backend, enqueued_at, finished_at, model=None):
+    if backend in latency_histograms:
+        latency_histograms[backend].observe(finished_at - enqueued_at)
+    if backend:
+        metrics.observe("upstream_latency_seconds", finished_at - enqueued_at, backend=backend, model=_upstream_model_label(backend, model))
+
+def _record_upstream_timings(timings, enqueued_at, started_at, finished_at):
+    if timings is None:
+        return
+    if started_at is None:
+        started_at = finished_at
+    timings["queue_wait_ms"] = timings.get("queue_wait_ms", 0.0) + round((started_at - enqueued_at) * 1000, 2)
+    timings["upstream_ms"] = timings.get("upstream_ms", 0.0) + round((finished_at - started_at) * 1000, 2)
+
+def _count_upstream_error(backend, model):
+    if backend:
+        metrics.inc("upstream_errors_total", backend=backend, model=_upstream_model_label(backend, model))
+
+async def run_upstream(func, *args, timings=None, timeout=None, backend=None, model=None):
+    """Run a blocking upstream call on the executor without blocking the event loop.
+
+    Waits for admission in the request's priority lane first (429 when that
+    lane is full). Raises 503 when the executor backlog is full and 504 when
+    the call does not finish within the timeout. Queue wait and upstream
+    time (ms) are added to ``timings`` when given, and successful (or
+    cancelled) calls are recorded in the ``backend`` latency histogram and the
+    per-model metrics.
+    """
+    release_slot = await _admit_upstream_call()
+    enqueued_at = time.perf_counter()
+    started = {}
+
+    def call():
+        started["at"] = time.perf_counter()
+        return func(*args)
+
+    # Copy the request context so client setup inside the worker lands in this request's Server-Timing
+    future = _upstream_executor.submit(contextvars.copy_context().run, call)
+    future.add_done_callback(release_slot)
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout or UPSTREAM_TIMEOUT)
+        _observe_backend_latency(backend, enqueued_at, time.perf_counter(), model)
+        return result
+    except asyncio.TimeoutError:
+        future.cancel()
+        _observe_backend_latency(backend, enqueued_at, time.perf_counter(), model)
+        _count_upstream_error(backend, model)
+        raise HTTPException(status_code=504, detail="Upstream translation call timed out.")
+    except asyncio.CancelledError:
+        # A cancelled (e.g. hedged-out) call still tells us the backend was at least this slow
+        _observe_backend_latency(backend, enqueued_at, time.perf_counter(), model)
+        raise
+    except Exception:
+        _count_upstream_error(backend, model)
+        raise
+    finally:
+        finished_at = time.perf_counter()
+        _record_upstream_timings(timings, enqueued_at, started.get("at"), finished_at)
+        _add_server_timing("upstream", finished_at - enqueued_at)
+
+_STREAM_END = object()
+
+async def stream_upstream(func, *args, timings=None, timeout=None, backend=None, model=None):
+    """Iterate a blocking upstream generator on the executor, yielding items as they arrive.
+
+    Same admission, queue limit and timeout as run_upstream, with the timeout
+    covering the whole stream. Closing the iterator (e.g. on client disconnect) stops the
+    worker thread at the next chunk. Time to first chunk is recorded as
+    ``first_chunk_ms``, and completed streams in the ``backend`` histogram.
+    """
+    release_slot = await _admit_upstream_call()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+    enqueued_at = time.perf_counter()
+    started = {}
+
+    def publish(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            cancelled.set()  # event loop is gone
+
+    def pump():
+        started["at"] = time.perf_counter()
+        try:
+            iterator = iter(func(*args))
+            try:
+                for item in iterator:
+                    if cancelled.is_set():
+                        return
+                    publish(item)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            publish(None, e)
+            return
+        publish(_STREAM_END)
+
+    future = _upstream_executor.submit(contextvars.copy_context().run, pump)
+    future.add_done_callback(release_slot)
+    deadline = loop.time() + (timeout or UPSTREAM_TIMEOUT)
+    first_chunk = True
+    try:
+        while True:
+            try:
+                item, error = await asyncio.wait_for(queue.get(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                _observe_backend_latency(backend, enqueued_at, time.perf_counter(), model)
+                _count_upstream_error(backend, model)
+                raise HTTPException(status_code=504, detail="Upstream translation call timed out.")
+            except asyncio.CancelledError:
+                _observe_backend_latency(backend, enqueued_at, time.perf_counter(), model)
+                raise
+            if error is not None:
+                _count_upstream_error(backend, model)
+                raise error
+            if item is _STREAM_END:
+                _observe_backend_latency(backend, enqueued_at, time.perf_counter(), model)
+                break
+            if first_chunk:
+                first_chunk = False
+                elapsed = time.perf_counter() - enqueued_at
+                if timings is not None and "first_chunk_ms" not in timings:
+                    timings["first_chunk_ms"] = round(elapsed * 1000, 2)
+                if backend:
+                    metrics.observe("upstream_first_chunk_seconds", elapsed, backend=backend, model=_upstream_model_label(backend, model))
+                _add_server_timing("first_chunk", elapsed)
+            yield item
+    finally:
+        cancelled.set()
+        future.cancel()
+        finished_at = time.perf_counter()
+        _record_upstream_timings(timings, enqueued_at, started.get("at"), finished_at)
+        _add_server_timing("upstream", finished_at - enqueued_at)
+
+class GeminiModelPool:
+    """Bounded LRU pool of ready GenerativeModel instances keyed by API key, model and system instruction.
+
+    Each entry owns its own GenerativeServiceClient (and therefore its own
+    transport) bound to the entry's API key, so concurrent requests with
+    different keys never touch the process-wide genai.configure() state.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._generation_config = None
+
+    def generation_config(self):
+        if self._generation_config is None:
+            self._generation_config = get_types().GenerationConfig(response_mime_type="text/plain")
+        return self._generation_config
+
+    def get(self, api_key, model_name, system_instruction=None):
+        key = (api_key, model_name, system_instruction)
+        with self.lock:
+            model = self.entries.get(key)
+            if model is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return model
+            self.stats["misses"] += 1
+
+        build_started = time.perf_counter()
+        model = self._build(api_key, model_name, system_instruction)
+        record_stage("client_setup", time.perf_counter() - build_started, backend="gemini")
+
+        with self.lock:
+            existing = self.entries.get(key)
+            if existing is not None:
+                return existing
+            self.entries[key] = model
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return model
+
+    def _build(self, api_key, model_name, system_instruction):
+        genai = get_genai()
+        glm = get_glm()
+        if system_instruction:
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+        else:
+            model = genai.GenerativeModel(model_name)
+        # _client is private SDK state (see the google-generativeai pin in requirements-minimal.txt).
+        # Falling back to the process-wide genai.configure() would let a cached model run with
+        # another key's credentials, so refuse to build a model without its own client instead.
+        if glm is None or not hasattr(model, "_client"):
+            raise RuntimeError(
+                "Cannot bind a per-key Gemini client: google.ai.generativelanguage is missing or this "
+                "google-generativeai version has no GenerativeModel._client; install a supported version"
+            )
+        model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        return model
+
+    def warm_up(self, api_key, model_name, system_instructions):
+        for system_instruction in system_instructions:
+            self.get(api_key, model_name, system_instruction)
+        self.generation_config()
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "max_entries": self.max_entries}
+
+gemini_model_pool = GeminiModelPool(GEMINI_MODEL_POOL_SIZE)
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``per_minute`` tokens per minute"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until ``amount`` tokens are available (amounts above capacity only need a full bucket)"""
+        needed = min(amount, self.capacity) - self.tokens
+        return max(needed, 0) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount):
+        self.tokens -= amount
+
+def estimate_tokens(*texts):
+    """Rough token estimate (about four characters per token)"""
+    return max(1, sum(len(text) for text in texts if text) // 4)
+
+def is_quota_error(error):
+    """True for 429 / quota-exhausted errors from the Gemini API"""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+def is_auth_error(error):
+    """True for invalid, revoked or unauthorized API key errors (400 API_KEY_INVALID / 401 / 403)"""
+    if getattr(error, "code", None) in (401, 403) or getattr(error, "status_code", None) in (401, 403):
+        return True
+    if type(error).__name__ in ("Unauthenticated", "PermissionDenied", "Unauthorized", "Forbidden"):
+        return True
+    message = str(error).lower()
+    return "api_key_invalid" in message or "api key not valid" in message or "api key expired" in message
+
+class ApiKeyScheduler:
+    """Spreads Gemini calls across all stored API keys.
+
+    Every key has request-per-minute and token-per-minute buckets. A key that
+    hits a 429 / quota error goes on cooldown (doubling on repeated errors);
+    a key rejected as invalid or unauthorized is taken out of rotation for
+    ``invalid_cooldown`` seconds. Each call goes to the healthy key with the
+    fewest in-flight calls and the most remaining budget.
+    """
+
+    def __init__(self, rpm, tpm, cooldown, max_cooldown, invalid_cooldown):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.invalid_cooldown = invalid_cooldown
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def configured_keys(self):
+        settings = dictionaries_cache.get("settings", {})
+        keys = [settings.get("current_api_key")] + list(settings.get("api_keys", [])) + [GEMINI_API_KEY]
+        return list(dict.fromkeys(key for key in keys if key))
+
+    def _state(self, api_key):
+        state = self.keys.get(api_key)
+        if state is None:
+            state = {
+                "requests_bucket": TokenBucket(self.rpm),
+                "tokens_bucket": TokenBucket(self.tpm),
+                "in_flight": 0,
+                "cooldown_until": 0.0,
+                "invalid_until": 0.0,
+                "consecutive_errors": 0,
+                "requests": 0,
+                "tokens": 0,
+                "errors": 0,
+                "rate_limited": 0,
+                "invalid": 0,
+            }
+            self.keys[api_key] = state
+        return state
+
+    def acquire(self, tokens, exclude=()):
+        """Reserve a request and ``tokens`` on the best available key and return the key"""
+        now = time.monotonic()
+        best = None
+        best_score = None
+        retry_after = None
+        with self.lock:
+            for api_key in self.configured_keys():
+                if api_key in exclude:
+                    continue
+                state = self._state(api_key)
+                if state["invalid_until"] > now:
+                    continue
+                state["requests_bucket"].refill(now)
+                state["tokens_bucket"].refill(now)
+                wait = max(
+                    state["cooldown_until"] - now,
+                    state["requests_bucket"].wait_time(1),
+                    state["tokens_bucket"].wait_time(tokens)
+                )
+                if wait > 0:
+                    retry_after = wait if retry_after is None else min(retry_after, wait)
+                    continue
+                score = (
+                    state["in_flight"],
+                    -state["requests_bucket"].tokens / self.rpm,
+                    -state["tokens_bucket"].tokens / self.tpm
+                )
+                if best_score is None or score < best_score:
+                    best, best_score = api_key, score
+            if best is None:
+                if retry_after is None:
+                    if any(self._state(api_key)["invalid_until"] > now for api_key in self.configured_keys()):
+                        raise HTTPException(status_code=502, detail="No valid Gemini API key available.")
+                    raise HTTPException(status_code=400, detail="No Gemini API key configured.")
+                raise HTTPException(
+                    status_code=429,
+                    detail="All Gemini API keys are rate limited, please retry shortly.",
+                    headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+                )
+            state = self.keys[best]
+            state["requests_bucket"].take(1)
+            state["tokens_bucket"].take(tokens)
+            state["in_flight"] += 1
+            state["requests"] += 1
+            state["tokens"] += tokens
+        return best
+
+    def release(self, api_key, output_tokens=0, error=None):
+        with self.lock:
+            state = self._state(api_key)
+            state["in_flight"] -= 1
+            state["tokens_bucket"].take(output_tokens)
+            state["tokens"] += output_tokens
+            if error is None:
+                state["consecutive_errors"] = 0
+                return
+            state["errors"] += 1
+            if is_quota_error(error):
+                state["rate_limited"] += 1
+                state["consecutive_errors"] += 1
+                cooldown = min(self.cooldown * 2 ** (state["consecutive_errors"] - 1), self.max_cooldown)
+                state["cooldown_until"] = time.monotonic() + cooldown
+                log_event("api_key_cooldown", level="warning", key=f"...{api_key[-4:]}", cooldown_s=round(cooldown))
+            elif is_auth_error(error):
+                state["invalid"] += 1
+                state["invalid_until"] = time.monotonic() + self.invalid_cooldown
+                log_event("api_key_disabled", level="warning", key=f"...{api_key[-4:]}",
+                          disabled_s=round(self.invalid_cooldown), error=str(error)[:200])
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            usage = []
+            for api_key in self.configured_keys():
+                state = self._state(api_key)
+                state["requests_bucket"].refill(now)
+                state["tokens_bucket"].refill(now)
+                usage.append({
+                    "key": f"...{api_key[-4:]}",
+                    "in_flight": state["in_flight"],
+                    "requests": state["requests"],
+                    "tokens": state["tokens"],
+                    "errors": state["errors"],
+                    "rate_limited": state["rate_limited"],
+                    "invalid": state["invalid"],
+                    "cooldown_remaining": round(max(state["cooldown_until"] - now, 0), 1),
+                    "disabled_remaining": round(max(state["invalid_until"] - now, 0), 1),
+                    "requests_available": round(state["requests_bucket"].tokens, 1),
+                    "tokens_available": round(state["tokens_bucket"].tokens),
+                })
+        return {"rpm": self.rpm, "tpm": self.tpm, "keys": usage}
+
+api_key_scheduler = ApiKeyScheduler(
+    GEMINI_KEY_RPM, GEMINI_KEY_TPM, GEMINI_KEY_COOLDOWN, GEMINI_KEY_MAX_COOLDOWN, GEMINI_KEY_INVALID_COOLDOWN
+)
+
+def _retry_after_header(seconds):
+    return {"Retry-After": str(max(1, int(seconds + 0.999)))}
+
+class ClientLimiter:
+    """Per-client concurrent request and requests-per-minute limits (clients keyed by token or IP)"""
+
+    def __init__(self, max_concurrency, rpm, max_clients=10000):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.max_clients = max_clients
+        self.clients = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"admitted": 0, "rejected_concurrency": 0, "rejected_rate": 0}
+
+    def enter(self, client):
+        now = time.monotonic()
+        with self.lock:
+            state = self.clients.get(client)
+            if state is None:
+                state = {"in_flight": 0, "bucket": TokenBucket(self.rpm) if self.rpm > 0 else None, "rejected": 0}
+                self.clients[client] = state
+                self._evict_idle()
+            self.clients.move_to_end(client)
+            if self.max_concurrency and state["in_flight"] >= self.max_concurrency:
+                state["rejected"] += 1
+                self.stats["rejected_concurrency"] += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many concurrent translation requests from this client.",
+                    headers=_retry_after_header(1)
+                )
+            bucket = state["bucket"]
+            if bucket is not None:
+                bucket.refill(now)
+                wait = bucket.wait_time(1)
+                if wait > 0:
+                    state["rejected"] += 1
+                    self.stats["rejected_rate"] += 1
+                    raise HTTPException(
+                        status_code=429,
+                        detail="Translation request rate limit exceeded for this client.",
+                        headers=_retry_after_header(wait)
+                    )
+                bucket.take(1)
+            state["in_flight"] += 1
+            self.stats["admitted"] += 1
+
+    def exit(self, client):
+        with self.lock:
+            state = self.clients.get(client)
+            if state is not None:
+                state["in_flight"] -= 1
+
+    def _evict_idle(self):
+        if len(self.clients) <= self.max_clients:
+            return
+        for client in list(self.clients):
+            if len(self.clients) <= self.max_clients:
+                break
+            if self.clients[client]["in_flight"] == 0:
+                del self.clients[client]
+
+    def snapshot(self):
+        with self.lock:
+            busiest = sorted(self.clients.items(), key=lambda item: (item[1]["in_flight"], item[1]["rejected"]), reverse=True)[:20]
+            return {
+                **self.stats,
+                "max_concurrency": self.max_concurrency,
+                "rpm": self.rpm,
+                "clients": len(self.clients),
+                "top_clients": [
+                    {"client": client, "in_flight": state["in_flight"], "rejected": state["rejected"]}
+                    for client, state in busiest
+                ]
+            }
+
+client_limiter = ClientLimiter(CLIENT_MAX_CONCURRENCY, CLIENT_RPM)
+
+class UpstreamAdmission:
+    """Global cap on in-flight upstream calls with one wait queue per priority lane.
+
+    Free slots go to the waiting lanes by smooth weighted round robin, so bulk
+    traffic keeps a share of capacity without starving interactive requests.
+    A full lane queue, or a wait longer than the lane's timeout, is a 429.
+    """
+
+    def __init__(self, max_in_flight, lanes):
+        self.max_in_flight = max_in_flight
+        self.lanes = lanes  # name -> {"weight", "max_queue", "timeout"}
+        self.queues = {lane: deque() for lane in lanes}
+        self.credit = {lane: 0 for lane in lanes}
+        self.in_flight = 0
+        self.stats = {lane: {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0} for lane in lanes}
+
+    def _waiting(self):
+        return any(self.queues.values())
+
+    def retry_after(self, lane):
+        """Rough time until a new request in ``lane`` would get a slot"""
+        histogram = latency_histograms["gemini"]
+        mean = histogram.total / histogram.count if histogram.count else 1.0
+        return max(1.0, (len(self.queues[lane]) + 1) * mean / max(self.max_in_flight, 1))
+
+    async def acquire(self, lane):
+        stats = self.stats[lane]
+        if self.in_flight < self.max_in_flight and not self._waiting():
+            self.in_flight += 1
+            stats["admitted"] += 1
+            return
+        queue = self.queues[lane]
+        if len(queue) >= self.lanes[lane]["max_queue"]:
+            stats["rejected"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Translation service is at capacity, please retry shortly.",
+                headers=_retry_after_header(self.retry_after(lane))
+            )
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        stats["queued"] += 1
+        queued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.lanes[lane]["timeout"])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # the slot was granted just as we gave up
+            else:
+                waiter.cancel()
+                if waiter in queue:
+                    queue.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                stats["timed_out"] += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Translation service is at capacity, please retry shortly.",
+                    headers=_retry_after_header(self.retry_after(lane))
+                )
+            raise
+        finally:
+            record_stage("admission_wait", time.perf_counter() - queued_at, lane=lane)
+        stats["admitted"] += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight:
+            waiting = [lane for lane, queue in self.queues.items() if queue]
+            if not waiting:
+                return
+            total = 0
+            for lane in waiting:
+                self.credit[lane] += self.lanes[lane]["weight"]
+                total += self.lanes[lane]["weight"]
+            lane = max(waiting, key=lambda name: self.credit[name])
+            self.credit[lane] -= total
+            waiter = self.queues[lane].popleft()
+            if waiter.done():
+                continue  # its request went away
+            waiter.set_result(None)
+            self.in_flight += 1
+
+    def snapshot(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "lanes": {
+                lane: {**config, **self.stats[lane], "waiting": len(self.queues[lane])}
+                for lane, config in self.lanes.items()
+            }
+        }
+
+upstream_admission = UpstreamAdmission(ADMISSION_MAX_IN_FLIGHT, {
+    "interactive": {"weight": ADMISSION_INTERACTIVE_WEIGHT, "max_queue": ADMISSION_INTERACTIVE_QUEUE, "timeout": ADMISSION_INTERACTIVE_TIMEOUT},
+    "bulk": {"weight": ADMISSION_BULK_WEIGHT, "max_queue": ADMISSION_BULK_QUEUE, "timeout": ADMISSION_BULK_TIMEOUT},
+})
+
+def gemini_generate_stream(model_name, prompt_text, system_instruction=None):
+    """Blocking Gemini call yielding text chunks as the model produces them.
+
+    The API key is chosen by api_key_scheduler; a call that fails on a rate-limited
+    or invalid key is retried on the next available key as long as nothing has
+    been yielded yet.
+    """
+    types = get_types()
+    tried = set()
+    while True:
+        api_key = api_key_scheduler.acquire(estimate_tokens(prompt_text, system_instruction), exclude=tried)
+        tried.add(api_key)
+        yielded = []
+        try:
+            model_gemini = gemini_model_pool.get(api_key, model_name, system_instruction)
+            response_stream = model_gemini.generate_content(
+                contents=[types.Content(role="user", parts=[types.Part.from_text(text=prompt_text)])],
+                generation_config=gemini_model_pool.generation_config(),
+                stream=True
+            )
+            for chunk in response_stream:
+                yielded.append(chunk.text)
+                yield chunk.text
+        except Exception as e:
+            api_key_scheduler.release(api_key, estimate_tokens(*yielded), error=e)
+            if (is_quota_error(e) or is_auth_error(e)) and not yielded and len(tried) < len(api_key_scheduler.configured_keys()):
+                continue
+            raise
+        except BaseException:
+            api_key_scheduler.release(api_key, estimate_tokens(*yielded))
+            raise
+        api_key_scheduler.release(api_key, estimate_tokens(*yielded))
+        return
+
+def gemini_generate(model_name, prompt_text, system_instruction=None):
+    """Blocking Gemini call; consumes the response stream and returns the full text"""
+    return "".join(gemini_generate_stream(model_name, prompt_text, system_instruction))
+
+def cloud_translate_batch(translation_client, texts):
+    """Blocking Google Cloud Translation call for a list of texts, results in input order"""
+    response = translation_client.translate_text(
+        request={
+            "parent": parent,
+            "contents": list(texts),
+            "mime_type": "text/plain",
+            "source_language_code": "en-US",
+            "target_language_code": "bn",
+            "model": GOOGLE_CLOUD_MODEL,
+        }
+    )
+    return [translation.translated_text for translation in response.translations]
+
+def cloud_translate(translation_client, text):
+    """Blocking Google Cloud Translation call for a single text"""
+    return cloud_translate_batch(translation_client, [text])[0]
+
+# Default configuration
+DEFAULT_DICTIONARIES = {
+    "word_replacement": {},
+    "keyword_based": {},
+    "single_word": {},
+    "gemini_keyword_prompts": {},
+    "settings": {
+        "ai_mode_enabled": False,
+        "api_keys": [],
+        "model_names": [],
+        "current_api_key": GEMINI_API_KEY or "",
+        "current_model_name": "gemini-2.5-flash-preview-05-20"
+    }
+}
+
+DEFAULT_GENERAL_PROMPT = "You are an experienced English to Bengali translator. You will translate the provided text into fluent and accurate bengali. Do not output anything other than the translation."
+
+# In-process copy of the dictionaries; the /translate hot path only ever reads these.
+# They are loaded from (and written through to) dictionary_store below.
+dictionaries_cache = json.loads(json.dumps(DEFAULT_DICTIONARIES))
+general_prompt_cache = DEFAULT_GENERAL_PROMPT
+
+DICTIONARY_TYPES = ["word_replacement", "keyword_based", "single_word", "gemini_keyword_prompts"]
+
+class DictionaryStore:
+    """In-process dictionary store without persistence.
+
+    Base class for shared backends: a backend persists each change, bumps a
+    store-wide version in the same transaction and returns it, so workers can
+    detect changes by comparing ``current_version()`` with the version they
+    last loaded.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.version = 0
+        self.store_id = uuid.uuid4().hex[:12]
+        # (dict_type, key) -> version of its last change; settings and the general prompt use key ""
+        self.changes = {}
+        self.changes_from = 0
+
+    def current_version(self):
+        return self.version
+
+    def changed_since(self, version):
+        """(dict_type, key) pairs changed after ``version``, or None when that version is not covered"""
+        if version < self.changes_from or version > self.version:
+            return None
+        return [change for change, changed_at in self.changes.items() if changed_at > version]
+
+    def _changed(self, changes):
+        self.version += 1
+        for change in changes:
+            self.changes[change] = self.version
+        return self.version
+
+    def load(self):
+        """Return (version, dictionaries, general_prompt), or None when nothing is stored"""
+        return None
+
+    def seed(self, dictionaries, general_prompt):
+        return self.version
+
+    def put_entry(self, dict_type, key, entry):
+        return self._changed([(dict_type, key)])
+
+    def put_entries(self, changes):
+        """Apply many (dict_type, key, entry or None to delete) changes as one version"""
+        return self._changed([(dict_type, key) for dict_type, key, _ in changes])
+
+    def delete_entry(self, dict_type, key):
+        return self._changed([(dict_type, key)])
+
+    def put_settings(self, settings):
+        return self._changed([("settings", "")])
+
+    def put_general_prompt(self, prompt):
+        return self._changed([("general_prompt", "")])
+
+class SQLiteDictionaryStore(DictionaryStore):
+    """Dictionary store in a SQLite database (WAL mode) shared by all workers on a host"""
+
+    shared = True
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(dict_type TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (dict_type, key))"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS changes "
+            "(dict_type TEXT NOT NULL, key TEXT NOT NULL, version INTEGER NOT NULL, PRIMARY KEY (dict_type, key))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS changes_version ON changes (version)")
+        self.db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('version', '0')")
+        self.db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('store_id', ?)", (uuid.uuid4().hex[:12],))
+        # Databases created before change tracking can only serve deltas from here on
+        self.db.execute("INSERT OR IGNORE INTO meta (name, value) SELECT 'changes_from', value FROM meta WHERE name = 'version'")
+        self.store_id = self.db.execute("SELECT value FROM meta WHERE name = 'store_id'").fetchone()[0]
+
+    def current_version(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        return int(row[0])
+
+    def load(self):
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                meta = dict(self.db.execute("SELECT name, value FROM meta").fetchall())
+                # rowid order preserves insertion order (upserts keep their row)
+                rows = self.db.execute("SELECT dict_type, key, value FROM entries ORDER BY rowid").fetchall()
+            finally:
+                self.db.execute("COMMIT")
+        if "settings" not in meta:
+            return None
+        dictionaries = {dict_type: {} for dict_type in DICTIONARY_TYPES}
+        for dict_type, key, value in rows:
+            dictionaries.setdefault(dict_type, {})[key] = json.loads(value)
+        dictionaries["settings"] = json.loads(meta["settings"])
+        return int(meta["version"]), dictionaries, meta.get("general_prompt", DEFAULT_GENERAL_PROMPT)
+
+    def changed_since(self, version):
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                meta = dict(self.db.execute("SELECT name, value FROM meta WHERE name IN ('version', 'changes_from')").fetchall())
+                rows = self.db.execute("SELECT dict_type, key FROM changes WHERE version > ?", (version,)).fetchall()
+            finally:
+                self.db.execute("COMMIT")
+        if version < int(meta["changes_from"]) or version > int(meta["version"]):
+            return None
+        return [tuple(row) for row in rows]
+
+    def _write(self, statements, changes=()):
+        """Run statements and bump the version in one transaction; returns the new version"""
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self.db.execute(sql, params)
+                self.db.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE name = 'version'")
+                version = int(self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()[0])
+                self.db.executemany(
+                    "INSERT INTO changes (dict_type, key, version) VALUES (?, ?, ?) "
+                    "ON CONFLICT(dict_type, key) DO UPDATE SET version = excluded.version",
+                    [(dict_type, key, version) for dict_type, key in changes]
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        self.version = version
+        return version
+
+    def _put_meta(self, name, value):
+        return ("INSERT INTO meta (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value", (name, value))
+
+    def _put_entry(self, dict_type, key, entry):
+        return (
+            "INSERT INTO entries (dict_type, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(dict_type, key) DO UPDATE SET value = excluded.value",
+            (dict_type, key, json.dumps(entry, ensure_ascii=False))
+        )
+
+    def seed(self, dictionaries, general_prompt):
+        statements = [
+            self._put_entry(dict_type, key, entry)
+            for dict_type in DICTIONARY_TYPES
+            for key, entry in dictionaries.get(dict_type, {}).items()
+        ]
+        statements.append(self._put_meta("settings", json.dumps(dictionaries["settings"], ensure_ascii=False)))
+        statements.append(self._put_meta("general_prompt", general_prompt))
+        changes = [(dict_type, key) for dict_type in DICTIONARY_TYPES for key in dictionaries.get(dict_type, {})]
+        return self._write(statements, changes + [("settings", ""), ("general_prompt", "")])
+
+    def _delete_entry(self, dict_type, key):
+        return ("DELETE FROM entries WHERE dict_type = ? AND key = ?", (dict_type, key))
+
+    def put_entry(self, dict_type, key, entry):
+        return self._write([self._put_entry(dict_type, key, entry)], [(dict_type, key)])
+
+    def put_entries(self, changes):
+        return self._write(
+            [self._put_entry(dict_type, key, entry) if entry is not None else self._delete_entry(dict_type, key)
+             for dict_type, key, entry in changes],
+            [(dict_type, key) for dict_type, key, _ in changes]
+        )
+
+    def delete_entry(self, dict_type, key):
+        return self._write([self._delete_entry(dict_type, key)], [(dict_type, key)])
+
+    def put_settings(self, settings):
+        return self._write([self._put_meta("settings", json.dumps(settings, ensure_ascii=False))], [("settings", "")])
+
+    def put_general_prompt(self, prompt):
+        return self._write([self._put_meta("general_prompt", prompt)], [("general_prompt", "")])
+
+def create_dictionary_store():
+    """Build the store selected by DICTIONARY_STORE, falling back to memory if it cannot be opened"""
+    if DICTIONARY_STORE == "sqlite":
+        try:
+            store = SQLiteDictionaryStore(DICTIONARY_STORE_PATH)
+            print(f"INFO: Dictionaries persisted to {DICTIONARY_STORE_PATH}")
+            return store
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not open dictionary store {DICTIONARY_STORE_PATH}: {e}; keeping dictionaries in memory")
+    elif DICTIONARY_STORE != "memory":
+        print(f"WARNING: Unknown DICTIONARY_STORE '{DICTIONARY_STORE}'; keeping dictionaries in memory")
+    return DictionaryStore()
+
+dictionary_store = create_dictionary_store()
+
+# Bumped whenever dictionary data changes so compiled lookups can be rebuilt lazily;
+# with a shared store this is the store-wide version this worker has loaded
+dictionary_version = 0
+_compiled_dictionaries = None
+
+def reload_dictionaries():
+    """Swap in a fresh copy of the store's data (readers keep using the old objects until then)"""
+    global dictionaries_cache, general_prompt_cache, dictionary_version
+    loaded = dictionary_store.load()
+    if loaded is None:
+        dictionary_version = dictionary_store.seed(dictionaries_cache, general_prompt_cache)
+        return
+    version, dictionaries, general_prompt = loaded
+    settings = {**DEFAULT_DICTIONARIES["settings"], **dictionaries.get("settings", {})}
+    if not settings.get("current_api_key"):
+        settings["current_api_key"] = GEMINI_API_KEY or ""
+    dictionaries_cache = {**dictionaries, "settings": settings}
+    general_prompt_cache = general_prompt
+    dictionary_version = version
+
+async def bump_dictionary_version(new_version=None):
+    """Record a change this worker made and persisted.
+
+    If the store moved on by more than this one change, another worker wrote
+    in between and the full state is reloaded, off the event loop.
+    """
+    global dictionary_version
+    if new_version is None:
+        dictionary_version += 1
+    elif new_version == dictionary_version + 1 or not dictionary_store.shared:
+        dictionary_version = new_version
+    else:
+        await asyncio.to_thread(reload_dictionaries)
+
+async def sync_dictionaries():
+    """Poll the shared store and reload when another worker changed it"""
+    while True:
+        await asyncio.sleep(DICTIONARY_SYNC_INTERVAL)
+        try:
+            if await asyncio.to_thread(dictionary_store.current_version) != dictionary_version:
+                await asyncio.to_thread(reload_dictionaries)
+                print(f"INFO: Reloaded dictionaries at version {dictionary_version}")
+        except Exception as e:
+            print(f"WARNING: Dictionary sync failed: {e}")
+
+_phase_started = time.perf_counter()
+reload_dictionaries()
+record_startup_phase("load_dictionaries", time.perf_counter() - _phase_started)
+
+def _is_word_char(ch):
+    """Same definition of a word character as the re module's \\w for str patterns"""
+    return ch.isalnum() or ch == "_"
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton that reports which patterns occur in a text in one pass"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        self.always = []  # empty patterns match every text
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                self.always.append(index)
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text):
+        found = set(self.always)
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+class KeywordScan:
+    """Same results as KeywordAutomaton via one substring search per pattern; faster for a few patterns"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+
+    def find(self, text):
+        return {index for index, pattern in enumerate(self.patterns) if pattern in text}
+
+def keyword_matcher(patterns):
+    """A KeywordScan for small pattern lists, otherwise a KeywordAutomaton"""
+    if len(patterns) <= DICTIONARY_SCAN_MAX_ENTRIES:
+        return KeywordScan(patterns)
+    return KeywordAutomaton(patterns)
+
+class CompiledDictionaries:
+    """Precompiled form of the dictionaries used on the /translate hot path.
+
+    Small dictionaries (up to DICTIONARY_SCAN_MAX_ENTRIES entries of a kind) use
+    substring checks and one alternation regex, which run in C; larger ones use
+    the automaton and trie, whose cost doesn't grow with the number of entries.
+    """
+
+    _END = object()
+
+    def __init__(self, dictionaries, version=None):
+        self.version = version
+
+        # Keyword-based entries, longest keyword first (same order as before)
+        keyword_based = dictionaries.get("keyword_based", {})
+        self.keyword_entries = []
+        for keyword in sorted(keyword_based.keys(), key=len, reverse=True):
+            entry = keyword_based[keyword]
+            if not entry.get("enabled", True):
+                continue
+            self.keyword_entries.append((keyword, entry.get("original"), entry.get("replacement")))
+        self.keyword_automaton = keyword_matcher([keyword.lower() for keyword, _, _ in self.keyword_entries])
+
+        # Gemini keyword prompts, first enabled match in insertion order wins
+        self.prompt_entries = [
+            entry for keyword, entry in dictionaries.get("gemini_keyword_prompts", {}).items()
+            if entry.get("enabled", True)
+        ]
+        self.prompt_automaton = keyword_matcher([
+            keyword.lower() for keyword, entry in dictionaries.get("gemini_keyword_prompts", {}).items()
+            if entry.get("enabled", True)
+        ])
+
+        # Whole-word replacements; single_word entries override word_replacement ones
+        word_replacements = dictionaries.get("word_replacement", {})
+        single_word_replacements = dictionaries.get("single_word", {})
+        enabled_word_repl = {key: val.get("value") for key, val in word_replacements.items() if val.get("enabled", True)}
+        enabled_single_repl = {key: val.get("value") for key, val in single_word_replacements.items() if val.get("enabled", True)}
+        all_word_repl = {key: repl for key, repl in {**enabled_word_repl, **enabled_single_repl}.items() if key}
+        self.word_trie = {}
+        self.word_pattern = None
+        self.word_values = all_word_repl
+        if all_word_repl and len(all_word_repl) <= DICTIONARY_SCAN_MAX_ENTRIES:
+            # Longest key first, exactly the regex this class replaced
+            self.word_pattern = re.compile(
+                r"\b(" + "|".join(re.escape(key) for key in sorted(all_word_repl, key=len, reverse=True)) + r")\b"
+            )
+            all_word_repl = {}
+        for key, repl in all_word_repl.items():
+            node = self.word_trie
+            for ch in key:
+                node = node.setdefault(ch, {})
+            node[self._END] = (key, repl)
+
+        # Longest text any entry can match; streamed spans hold back at least this much
+        self.max_match_length = max(
+            [len(key) for key in self.word_values]
+            + [len(original) for _, original, replacement in self.keyword_entries if original and replacement]
+            + [0]
+        )
+
+    def match_keyword_prompt(self, original_english_text):
+        found = self.prompt_automaton.find(original_english_text.lower())
+        return self.prompt_entries[min(found)] if found else None
+
+    def apply(self, text, original_english_text):
+        used_entries = []
+
+        # Keyword-based replacements, only for keywords present in the English text
+        if self.keyword_entries:
+            for index in sorted(self.keyword_automaton.find(original_english_text.lower())):
+                keyword, original_bengali, replacement_bengali = self.keyword_entries[index]
+                if original_bengali and replacement_bengali and original_bengali in text:
+                    highlighted = f'<span style="color:red">{replacement_bengali}</span>'
+                    text = text.replace(original_bengali, highlighted)
+                    used_entries.append({"type": "keyword_based", "key": keyword, "original": original_bengali, "replacement": replacement_bengali})
+
+        if self.word_values:
+            text = self._replace_words(text, used_entries)
+
+        return text, used_entries
+
+    def split_point(self, text, original_english_text):
+        """Largest index after whitespace where ``text`` can be cut without splitting a dictionary
+        match, keeping at least max_match_length characters back for matches still being streamed"""
+        spans = []
+        if self.keyword_entries:
+            for index in self.keyword_automaton.find(original_english_text.lower()):
+                _, original_bengali, replacement_bengali = self.keyword_entries[index]
+                if not (original_bengali and replacement_bengali):
+                    continue
+                start = text.find(original_bengali)
+                while start >= 0:
+                    spans.append((start, start + len(original_bengali)))
+                    start = text.find(original_bengali, start + 1)
+        if self.word_values:
+            spans.extend((start, end) for start, end, _ in self._word_matches(text))
+
+        cut = len(text) - self.max_match_length
+        while cut > 0:
+            cut = max(text.rfind(" ", 0, cut), text.rfind("\n", 0, cut), text.rfind("\t", 0, cut)) + 1
+            if cut <= 0:
+                return 0
+            if not any(start < cut < end for start, end in spans):
+                return cut
+            cut -= 1
+        return 0
+
+    def _replace_words(self, text, used_entries):
+        pieces = []
+        last = 0
+        for start, end, (orig, repl) in self._word_matches(text):
+            if repl != orig:
+                used_entries.append({"type": "word_replacement/single_word", "key": orig, "original": orig, "replacement": repl})
+                pieces.append(text[last:start])
+                pieces.append(f'<span style="color:red">{repl}</span>')
+                last = end
+
+        if not pieces:
+            return text
+        pieces.append(text[last:])
+        return "".join(pieces)
+
+    def _word_matches(self, text):
+        """Single left-to-right pass equivalent to the old \\b(longest|...|shortest)\\b regex"""
+        if self.word_pattern is not None:
+            values = self.word_values
+            for match in self.word_pattern.finditer(text):
+                key = match.group(0)
+                yield match.start(), match.end(), (key, values[key])
+            return
+        root = self.word_trie
+        end_marker = self._END
+        length = len(text)
+
+        def at_boundary(pos):
+            before = pos > 0 and _is_word_char(text[pos - 1])
+            after = pos < length and _is_word_char(text[pos])
+            return before != after
+
+        i = 0
+        while i < length:
+            node = root.get(text[i])
+            if node is None or not at_boundary(i):
+                i += 1
+                continue
+            match = None
+            j = i
+            while node is not None:
+                j += 1
+                if end_marker in node and at_boundary(j):
+                    match = (j, node[end_marker])
+                if j >= length:
+                    break
+                node = node.get(text[j])
+            if match is None:
+                i += 1
+                continue
+            yield i, match[0], match[1]
+            i = match[0]
+
+def get_compiled_dictionaries():
+    """Compiled view of dictionaries_cache, rebuilt only when dictionary_version changes"""
+    global _compiled_dictionaries
+    compiled = _compiled_dictionaries
+    if compiled is None or compiled.version != dictionary_version:
+        compiled = CompiledDictionaries(dictionaries_cache, version=dictionary_version)
+        _compiled_dictionaries = compiled
+    return compiled
+
+def apply_dictionaries(text, dictionaries, original_english_text):
+    started = time.perf_counter()
+    if dictionaries is dictionaries_cache:
+        compiled = get_compiled_dictionaries()
+    else:
+        compiled = CompiledDictionaries(dictionaries)
+    result = compiled.apply(text, original_english_text)
+    record_stage("dictionaries", time.perf_counter() - started)
+    return result
+
+class TranslationCache:
+    """LRU + TTL cache of raw upstream translations with an optional SQLite backing store.
+
+    Disk reads run on a worker thread (``lookup``); new rows, last-used times
+    and expired-row deletions are written by a background thread in batches
+    every ``flush_interval`` seconds, so the event loop never waits on SQLite.
+    """
+
+    def __init__(self, max_entries, ttl, path=None, max_disk_entries=100000, flush_interval=2.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "disk_hits": 0}
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.pending = {}  # key -> row to insert on the next flush
+        self.touched = {}  # key -> last-used time to write on the next flush
+        self.expired = set()  # keys to delete on the next flush
+        self._disk_writes = 0
+        self._stop = threading.Event()
+        if path:
+            try:
+                self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS translations "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                self.db.commit()
+                print(f"INFO: Translation cache persisted to {path}")
+            except sqlite3.Error as e:
+                print(f"WARNING: Could not open translation cache database {path}: {e}")
+                self.db = None
+        if self.db is not None:
+            threading.Thread(
+                target=self._write_loop, args=(flush_interval,), name="translation-cache-writer", daemon=True
+            ).start()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    async def lookup(self, key):
+        """Memory lookup, falling back to the SQLite store on a worker thread"""
+        if not self.enabled:
+            return None
+        value = self._memory_get(key)
+        if value is not None or self.db is None:
+            return value
+        return await asyncio.to_thread(self._disk_get, key)
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self.lock:
+            self._store(key, value, now)
+            if self.db is not None:
+                self.pending[key] = (key, value, now, now)
+                self.expired.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.pending.clear()
+            self.touched.clear()
+            self.expired.clear()
+        if self.db is not None:
+            with self.db_lock:
+                self.db.execute("DELETE FROM translations")
+                self.db.commit()
+
+    def flush(self):
+        """Write pending rows, last-used times and expired-row deletions in one transaction"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            touched, self.touched = self.touched, {}
+            expired, self.expired = self.expired, set()
+        if self.db is None or not (pending or touched or expired):
+            return
+        now = time.time()
+        with self.db_lock:
+            try:
+                self.db.executemany("DELETE FROM translations WHERE key = ?", [(key,) for key in expired])
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO translations (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    list(pending.values())
+                )
+                self.db.executemany(
+                    "UPDATE translations SET accessed = ? WHERE key = ?",
+                    [(accessed, key) for key, accessed in touched.items() if key not in pending]
+                )
+                previous_writes, self._disk_writes = self._disk_writes, self._disk_writes + len(pending)
+                if self._disk_writes // 100 != previous_writes // 100:
+                    # Every ~100 new rows, drop expired rows and trim the table to its size bound
+                    self.db.execute("DELETE FROM translations WHERE created < ?", (now - self.ttl,))
+                    cursor = self.db.execute(
+                        "DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,)
+                    )
+                    with self.lock:
+                        self.stats["evictions"] += max(cursor.rowcount, 0)
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"WARNING: Translation cache write failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def _write_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "max_entries": self.max_entries,
+                    "ttl": self.ttl, "persistent": self.db is not None}
+
+    def _memory_get(self, key):
+        now = time.time()
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None:
+                value, created = item
+                if now - created <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value
+                del self.entries[key]
+                self.stats["expired"] += 1
+            if self.db is None:
+                self.stats["misses"] += 1
+            return None
+
+    def _store(self, key, value, created):
+        self.entries[key] = (value, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _disk_get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.pending.get(key)
+        if row is None:
+            try:
+                with self.db_lock:
+                    row = self.db.execute("SELECT key, value, created FROM translations WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"WARNING: Translation cache read failed: {e}")
+                row = None
+        with self.lock:
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            value, created = row[1], row[2]
+            if now - created > self.ttl:
+                self.expired.add(key)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._store(key, value, created)
+            self.touched[key] = now
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+            return value
+
+_phase_started = time.perf_counter()
+translation_cache = TranslationCache(
+    TRANSLATION_CACHE_SIZE,
+    TRANSLATION_CACHE_TTL,
+    path=TRANSLATION_CACHE_PATH,
+    max_disk_entries=TRANSLATION_CACHE_DISK_SIZE,
+    flush_interval=TRANSLATION_CACHE_FLUSH_INTERVAL
+)
+record_startup_phase("open_translation_cache", time.perf_counter() - _phase_started)
+
+def translation_cache_key(route, text):
+    """Cache key over everything that influences the raw upstream translation"""
+    normalized_text = unicodedata.normalize("NFC", text).strip()
+    key_parts = [
+        normalized_text,
+        route["mode"],
+        route["backend"],
+        route["model"],
+        route["keyword_prompt"],
+        route["general_prompt"],
+    ]
+    return hashlib.sha256(json.dumps(key_parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+_number_re = re.compile(r"\d+")
+_BENGALI_TO_ASCII_DIGITS = str.maketrans("০১২৩৪৫৬৭৮৯", "0123456789")
+_ASCII_TO_BENGALI_DIGITS = str.maketrans("0123456789", "০১২৩৪৫৬৭৮৯")
+
+# MinHash LSH: 20 bands of 3 rows. The parameters are fixed so signatures stored on disk stay valid.
+MINHASH_BANDS = 20
+MINHASH_ROWS = 3
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240611)
+_MINHASH_PARAMS = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+    for _ in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+def memory_key(text):
+    """Whitespace-collapsed text with every number masked to 0.
+
+    Case is kept: "Turkey" and "turkey" translate differently.
+    """
+    return _number_re.sub("0", " ".join(unicodedata.normalize("NFC", text).split()))
+
+def shingles(key, size=3):
+    return {key[i:i + size] for i in range(max(len(key) - size + 1, 1))}
+
+def minhash(shingle_set):
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingle_set]
+    return tuple(min((a * h + b) % _MINHASH_PRIME for h in hashes) & 0xFFFFFFFF for a, b in _MINHASH_PARAMS)
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second) if first or second else 1.0
+
+def transfer_numbers(source, translation, new_source):
+    """Translation of ``source`` adapted to ``new_source``, which differs only in its numbers.
+
+    Each changed number is replaced where it appears in the translation, in
+    ASCII or Bengali digits as found there. Returns None when the numbers do
+    not line up or a changed number does not appear in the translation.
+    """
+    old_numbers = [number.translate(_BENGALI_TO_ASCII_DIGITS) for number in _number_re.findall(source)]
+    new_numbers = [number.translate(_BENGALI_TO_ASCII_DIGITS) for number in _number_re.findall(new_source)]
+    if len(old_numbers) != len(new_numbers):
+        return None
+    mapping = {}
+    for old, new in zip(old_numbers, new_numbers):
+        if mapping.setdefault(old, new) != new:
+            return None
+    changed = {old for old, new in mapping.items() if old != new}
+    if not changed:
+        return translation
+    replaced = set()
+
+    def replace(match):
+        token = match.group(0)
+        value = token.translate(_BENGALI_TO_ASCII_DIGITS)
+        if value not in changed:
+            return token
+        replaced.add(value)
+        return mapping[value] if token == value else mapping[value].translate(_ASCII_TO_BENGALI_DIGITS)
+
+    adapted = _number_re.sub(replace, translation)
+    return adapted if replaced == changed else None
+
+class TranslationMemory:
+    """Fuzzy translation memory over earlier raw upstream translations.
+
+    Source texts are split into character 3-gram shingles with numbers masked
+    (so "Order 12 shipped" and "Order 7 shipped" look alike) and indexed by
+    MinHash LSH per route. Candidates sharing a band are ranked by shared
+    bands and verified with the exact Jaccard similarity. Only a source equal
+    up to numbers and spacing is reused as is; other matches are references.
+    Entries are kept in an LRU of ``max_entries``. With a ``path`` they are
+    also persisted to SQLite by a writer thread that commits new entries and
+    last-used times in batches every ``flush_interval`` seconds, so lookups
+    and additions never wait on the database.
+    """
+
+    def __init__(self, max_entries, threshold, max_chars, path=None, flush_interval=2.0):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_chars = max_chars
+        self.entries = OrderedDict()  # (route key, memory key) -> entry
+        self.bands = {}  # (route key, band, band values) -> set of entry ids
+        self.lock = threading.Lock()
+        self.stats = {"lookups": 0, "direct_hits": 0, "reference_hits": 0, "misses": 0, "added": 0, "evictions": 0}
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.pending = {}  # entry id -> row to insert on the next flush
+        self.touched = {}  # entry id -> last-used time to write on the next flush
+        self._disk_writes = 0
+        self._stop = threading.Event()
+        if path and self.enabled:
+            try:
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS memory (route TEXT NOT NULL, key TEXT NOT NULL, source TEXT NOT NULL, "
+                    "translation TEXT NOT NULL, signature BLOB NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (route, key))"
+                )
+                self.db.commit()
+                rows = self.db.execute(
+                    "SELECT route, key, source, translation, signature FROM memory ORDER BY accessed DESC LIMIT ?",
+                    (self.max_entries,)
+                ).fetchall()
+                for route_key, key, source, translation, signature in reversed(rows):
+                    self._store(route_key, key, source, translation, tuple(array("I", signature)))
+                print(f"INFO: Translation memory loaded {len(rows)} entries from {path}")
+            except sqlite3.Error as e:
+                print(f"WARNING: Could not open translation memory database {path}: {e}")
+                self.db = None
+        if self.db is not None:
+            threading.Thread(
+                target=self._write_loop, args=(flush_interval,), name="translation-memory-writer", daemon=True
+            ).start()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def lookup(self, route_key, text, reference=True):
+        """Closest earlier translation at or above the similarity threshold, or None.
+
+        The match has the earlier ``source`` and ``translation``, its
+        ``similarity`` and, when it can be reused as is, ``direct`` (the
+        translation with changed numbers carried over). Without ``reference``
+        only matches that can be reused as is are returned.
+        """
+        if not self.enabled or len(text) > self.max_chars:
+            return None
+        key = memory_key(text)
+        query = shingles(key)
+        signature = minhash(query)
+        with self.lock:
+            self.stats["lookups"] += 1
+            shared = Counter()
+            for bucket in self._band_keys(route_key, signature):
+                shared.update(self.bands.get(bucket, ()))
+            best, best_similarity = None, 0.0
+            for entry_id, _ in shared.most_common(10):
+                similarity = jaccard(query, shingles(entry_id[1]))
+                if similarity > best_similarity:
+                    best, best_similarity = self.entries[entry_id], similarity
+            if best is None or best_similarity < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            # Equal shingle sets don't mean equal texts ("ha ha" / "ha ha ha"): only reuse on an identical key
+            direct = None
+            if best["key"] == key:
+                direct = transfer_numbers(best["source"], best["translation"], text)
+            if direct is None and not reference:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end((route_key, best["key"]))
+            if self.db is not None:
+                self.touched[(route_key, best["key"])] = time.time()
+            self.stats["direct_hits" if direct is not None else "reference_hits"] += 1
+            return {
+                "source": best["source"],
+                "translation": best["translation"],
+                "similarity": round(best_similarity, 3),
+                "direct": direct
+            }
+
+    def add(self, route_key, text, translation):
+        if not self.enabled or len(text) > self.max_chars or not translation.strip():
+            return
+        key = memory_key(text)
+        signature = minhash(shingles(key))
+        with self.lock:
+            self._store(route_key, key, text, translation, signature)
+            self.stats["added"] += 1
+            if self.db is not None:
+                self.pending[(route_key, key)] = (
+                    route_key, key, text, translation, array("I", signature).tobytes(), time.time()
+                )
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bands.clear()
+            self.pending.clear()
+            self.touched.clear()
+        if self.db is not None:
+            with self.db_lock:
+                self.db.execute("DELETE FROM memory")
+                self.db.commit()
+
+    def flush(self):
+        """Write pending entries and last-used times in one transaction"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            touched, self.touched = self.touched, {}
+        if self.db is None or not (pending or touched):
+            return
+        with self.db_lock:
+            try:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO memory (route, key, source, translation, signature, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                    list(pending.values())
+                )
+                self.db.executemany(
+                    "UPDATE memory SET accessed = ? WHERE route = ? AND key = ?",
+                    [(accessed, route_key, key) for (route_key, key), accessed in touched.items() if (route_key, key) not in pending]
+                )
+                previous_writes, self._disk_writes = self._disk_writes, self._disk_writes + len(pending)
+                if self._disk_writes // 100 != previous_writes // 100:
+                    # Every ~100 new rows, trim the table to the entries the LRU would keep
+                    self.db.execute(
+                        "DELETE FROM memory WHERE rowid IN (SELECT rowid FROM memory ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,)
+                    )
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"WARNING: Translation memory write failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def _write_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.stats["lookups"]
+            hits = self.stats["direct_hits"] + self.stats["reference_hits"]
+            return {
+                **self.stats,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "direct_hit_rate": round(self.stats["direct_hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "persistent": self.db is not None
+            }
+
+    @staticmethod
+    def _band_keys(route_key, signature):
+        return [
+            (route_key, band, signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS])
+            for band in range(MINHASH_BANDS)
+        ]
+
+    def _store(self, route_key, key, source, translation, signature):
+        entry_id = (route_key, key)
+        if entry_id in self.entries:
+            self._unindex(entry_id)
+        self.entries[entry_id] = {"key": key, "source": source, "translation": translation, "signature": signature}
+        self.entries.move_to_end(entry_id)
+        for bucket in self._band_keys(route_key, signature):
+            self.bands.setdefault(bucket, set()).add(entry_id)
+        while len(self.entries) > self.max_entries:
+            self._unindex(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def _unindex(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        for bucket in self._band_keys(entry_id[0], entry["signature"]):
+            members = self.bands.get(bucket)
+            if members is not None:
+                members.discard(entry_id)
+                if not members:
+                    del self.bands[bucket]
+
+_phase_started = time.perf_counter()
+translation_memory = TranslationMemory(
+    TRANSLATION_MEMORY_SIZE,
+    TRANSLATION_MEMORY_THRESHOLD,
+    TRANSLATION_MEMORY_MAX_CHARS,
+    path=TRANSLATION_MEMORY_PATH or None,
+    flush_interval=TRANSLATION_MEMORY_FLUSH_INTERVAL
+)
+record_startup_phase("load_translation_memory", time.perf_counter() - _phase_started)
+
+def translation_memory_route_key(route):
+    """Translations are only reused between requests with the same backend, model and prompts"""
+    key_parts = [route["mode"], route["backend"], route["model"], route["keyword_prompt"], route["general_prompt"]]
+    return hashlib.sha256(json.dumps(key_parts, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+TRANSLATION_MEMORY_REFERENCE = (
+    "Reference: an earlier translation of a similar text. Reuse its wording and terminology where they apply, "
+    "but translate only the text given after it.\nSource: {source}\nTranslation: {translation}"
+)
+
+def consult_translation_memory(route, text, timings, allow_reference=True):
+    """Look ``text`` up in the translation memory.
+
+    Returns (raw, route): ``raw`` is set when a near-identical earlier
+    translation can be reused as is. Otherwise a close match is added to the
+    Gemini prompt of the returned route as a reference translation.
+    """
+    allow_reference = allow_reference and route["backend"] == "gemini"
+    match = translation_memory.lookup(translation_memory_route_key(route), text, reference=allow_reference)
+    if match is None:
+        timings["memory"] = "miss"
+        return None, route
+    if match["direct"] is not None:
+        timings["memory"] = "hit"
+        used_dictionaries = route["used_dictionaries"] + [
+            {"type": "translation_memory", "mode": "direct", "similarity": match["similarity"]}
+        ]
+        return match["direct"], {**route, "used_dictionaries": used_dictionaries}
+    timings["memory"] = "reference"
+    reference = TRANSLATION_MEMORY_REFERENCE.format(source=match["source"], translation=match["translation"])
+    if route["mode"] == "ai":
+        prompt = f"{reference}\n\nText to translate:\n{text}"
+    else:
+        prompt = f"{reference}\n\n{route['prompt']}"
+    used_dictionaries = route["used_dictionaries"] + [
+        {"type": "translation_memory", "mode": "reference", "similarity": match["similarity"]}
+    ]
+    return None, {**route, "prompt": prompt, "used_dictionaries": used_dictionaries}
+
+def store_translation(route, text, cache_key, raw):
+    """Remember a fresh upstream translation in the exact cache and the translation memory"""
+    translation_cache.set(cache_key, raw)
+    translation_memory.add(translation_memory_route_key(route), text, raw)
+
+def resolve_translation_route(text, original_english_text):
+    """Pick the backend, prompt and model for a translation request from the current settings"""
+    settings = dictionaries_cache["settings"]
+    ai_mode_enabled = settings.get("ai_mode_enabled", False)
+    current_model_name = settings.get("current_model_name", "gemini-2.5-flash-preview-05-20")
+    match_started = time.perf_counter()
+    matched_gemini_keyword = get_compiled_dictionaries().match_keyword_prompt(original_english_text)
+    record_stage("keyword_match", time.perf_counter() - match_started)
+    keyword_prompt = matched_gemini_keyword.get("prompt", "") if matched_gemini_keyword else None
+
+    route = {
+        "mode": "ai" if ai_mode_enabled else "standard",
+        "backend": "gemini",
+        "model": current_model_name,
+        "keyword_prompt": keyword_prompt,
+        "general_prompt": general_prompt_cache,
+        "system_instruction": None,
+        "prompt": text,
+        "used_dictionaries": [],
+    }
+    if matched_gemini_keyword:
+        route["used_dictionaries"].append({"type": "gemini_keyword_prompt", "key": matched_gemini_keyword.get("keyword"), "prompt": keyword_prompt})
+
+    if ai_mode_enabled:
+        # Use GenerativeModel with system_instruction for AI mode, sending the user's text as content
+        if matched_gemini_keyword:
+            route["system_instruction"] = f"{general_prompt_cache}\n\n{keyword_prompt}"
+        else:
+            route["system_instruction"] = general_prompt_cache
+            route["used_dictionaries"].append({"type": "gemini_ai_mode", "prompt": general_prompt_cache})
+    elif matched_gemini_keyword:
+        # For keyword-based, use the full prompt as content, not system_instruction
+        route["prompt"] = f"{general_prompt_cache}\n\n{keyword_prompt}\n\nTranslate the following text to Bengali: {text}"
+    else:
+        route["backend"] = "cloud"
+        route["model"] = GOOGLE_CLOUD_MODEL
+        route["general_prompt"] = None
+    return route
+
+async def cloud_fallback(text, timings):
+    """Fallback to Google Cloud Translation when a keyword-prompt Gemini call fails"""
+    fallback_client = get_google_cloud_client()
+    if not fallback_client:
+        raise HTTPException(status_code=500, detail="Translation service unavailable.")
+    try:
+        log_event("upstream_fallback", backend="cloud")
+        return await run_upstream(cloud_translate, fallback_client, text, timings=timings, backend="cloud")
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_event("translation_failed", level="error", backend="cloud", stage="fallback", error=str(e))
+        raise HTTPException(status_code=500, detail="An error occurred during translation.")
+
+def hedge_delay(backend, budget):
+    """How long to wait on ``backend`` before hedging, from its latency percentile"""
+    histogram = latency_histograms[backend]
+    threshold = histogram.percentile(HEDGE_PERCENTILE) if histogram.count >= HEDGE_MIN_SAMPLES else None
+    if threshold is None:
+        threshold = HEDGE_DEFAULT_DELAY
+    # Leave the backup request at least half of the budget
+    return min(max(threshold, HEDGE_MIN_DELAY), budget / 2)
+
+async def _collect_gemini(route, timings):
+    # Streaming lets a cancelled (losing) Gemini call stop its worker thread at the next chunk
+    pieces = []
+    async for piece in stream_upstream(
+        gemini_generate_stream, route["model"], route["prompt"], route["system_instruction"],
+        timings=timings, backend="gemini", model=route["model"]
+    ):
+        pieces.append(piece)
+    return "".join(pieces)
+
+async def call_upstream_hedged(route, text, timings, deadline=None):
+    """Keyword-prompt translation on Gemini with a hedged Cloud Translation backup.
+
+    If Gemini has not answered within its percentile-based hedge delay (or
+    fails), the same text is sent to Cloud Translation and the first
+    acceptable result wins; the other call is cancelled. The whole request
+    must finish within ``deadline`` seconds (TRANSLATION_DEADLINE by default).
+    """
+    loop = asyncio.get_running_loop()
+    budget = deadline or TRANSLATION_DEADLINE or UPSTREAM_TIMEOUT
+    ends_at = loop.time() + budget
+    delay = hedge_delay("gemini", budget)
+
+    log_event("upstream_call", backend="gemini", mode="keyword", model=route["model"], hedge_delay=round(delay, 3))
+    primary = asyncio.ensure_future(_collect_gemini(route, timings))
+    backup = None
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        while True:
+            for task in done:
+                tasks.discard(task)
+                error = task.exception()
+                if error is None and task.result().strip():
+                    if task is primary:
+                        timings["winner"] = "gemini"
+                        return task.result(), list(route["used_dictionaries"]), True
+                    timings["winner"] = "cloud"
+                    return task.result(), [], False
+                if isinstance(error, HTTPException) and error.status_code == 503:
+                    raise error
+                log_event(
+                    "translation_failed", level="warning", backend="gemini" if task is primary else "cloud",
+                    stage="hedged", error=str(error or "empty result"),
+                )
+
+            if backup is None:
+                fallback_client = get_google_cloud_client()
+                if fallback_client is not None:
+                    log_event("upstream_hedge", backend="cloud", after_ms=round(delay * 1000, 1))
+                    timings["hedged"] = True
+                    backup = asyncio.ensure_future(
+                        run_upstream(cloud_translate, fallback_client, text, timings=timings, backend="cloud")
+                    )
+                    tasks.add(backup)
+                elif not tasks:
+                    raise HTTPException(status_code=500, detail="Translation service unavailable.")
+
+            if not tasks:
+                raise HTTPException(status_code=500, detail="An error occurred during translation.")
+            remaining = ends_at - loop.time()
+            if remaining <= 0:
+                raise HTTPException(status_code=504, detail="Translation did not finish within its latency budget.")
+            done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise HTTPException(status_code=504, detail="Translation did not finish within its latency budget.")
+    finally:
+        for task in (primary, backup):
+            if task is not None and not task.done():
+                task.cancel()
+
+async def call_upstream(route, text, timings, deadline=None):
+    """Call the upstream backend chosen by resolve_translation_route.
+
+    Returns the raw translation, the upstream used_dictionaries entries and
+    whether the result may be cached (fallback results are not). ``deadline``
+    is the latency budget in seconds for hedged keyword-prompt requests.
+    """
+    if route["mode"] == "ai":
+        log_event("upstream_call", backend="gemini", mode="ai", model=route["model"])
+        try:
+            translated_text_raw = await run_upstream(
+                gemini_generate, route["model"], route["prompt"], route["system_instruction"],
+                timings=timings, backend="gemini", model=route["model"]
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            log_event("translation_failed", level="error", backend="gemini", mode="ai", error=str(e))
+            raise HTTPException(status_code=500, detail="An error occurred during AI Mode translation with Gemini.")
+        return translated_text_raw, list(route["used_dictionaries"]), True
+
+    if route["backend"] == "gemini":
+        if HEDGE_ENABLED:
+            return await call_upstream_hedged(route, text, timings, deadline)
+        log_event("upstream_call", backend="gemini", mode="keyword", model=route["model"])
+        try:
+            translated_text_raw = await run_upstream(
+                gemini_generate, route["model"], route["prompt"], timings=timings, backend="gemini", model=route["model"]
+            )
+            return translated_text_raw, list(route["used_dictionaries"]), True
+        except Exception as e:
+            if isinstance(e, HTTPException) and e.status_code == 503:
+                raise
+            log_event("translation_failed", level="warning", backend="gemini", mode="keyword", error=str(e))
+            return await cloud_fallback(text, timings), [], False
+
+    translation_client = get_google_cloud_client()
+    if not translation_client:
+        raise HTTPException(status_code=500, detail="Translation service unavailable.")
+    log_event("upstream_call", backend="cloud")
+    try:
+        translated_text_raw = await run_upstream(cloud_translate, translation_client, text, timings=timings, backend="cloud")
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_event("translation_failed", level="error", backend="cloud", error=str(e))
+        raise HTTPException(status_code=500, detail="An error occurred during translation.")
+    return translated_text_raw, [], True
+
+class SingleFlight:
+    """Shares one in-flight upstream call between concurrent requests with the same key.
+
+    The call runs as its own task, so a waiter whose client disconnects only
+    cancels its own wait; the call itself is cancelled once nobody waits on it.
+    Streaming requests can lead a flight too (see ``lead``), in which case
+    followers receive the complete result once the stream has finished.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key, factory):
+        """Await ``factory()`` or an identical call already in flight; returns (*result, coalesced)"""
+        call = self.calls.get(key)
+        if call is not None:
+            self.stats["coalesced"] += 1
+            return (*await self._wait(key, call), True)
+        call = {"task": asyncio.ensure_future(factory()), "external": False, "waiters": 0}
+        self._register(key, call)
+        return (*await self._wait(key, call), False)
+
+    async def join(self, key):
+        """Result of an identical call in flight, or None when there is none"""
+        call = self.calls.get(key)
+        if call is None:
+            return None
+        self.stats["coalesced"] += 1
+        return await self._wait(key, call)
+
+    def lead(self, key):
+        """Register a call driven by the caller; returns a future the caller must resolve"""
+        call = {"task": asyncio.get_running_loop().create_future(), "external": True, "waiters": 0}
+        self._register(key, call)
+        return call["task"]
+
+    def _register(self, key, call):
+        self.calls[key] = call
+        call["task"].add_done_callback(lambda _task: self._forget(key, call))
+        self.stats["calls"] += 1
+
+    async def _wait(self, key, call):
+        call["waiters"] += 1
+        try:
+            return await asyncio.shield(call["task"])
+        finally:
+            call["waiters"] -= 1
+            if call["waiters"] == 0 and not call["external"] and not call["task"].done():
+                call["task"].cancel()
+                self._forget(key, call)
+
+    def _forget(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    def snapshot(self):
+        return {**self.stats, "in_flight": len(self.calls)}
+
+single_flight = SingleFlight()
+
+async def translate_raw(text, original_english_text, timings, deadline=None):
+    """Raw upstream translation for a request, served from translation_cache when possible"""
+    route = resolve_translation_route(text, original_english_text)
+    cache_key = translation_cache_key(route, text)
+    cached = await translation_cache.lookup(cache_key)
+    if cached is not None:
+        timings["cache"] = "hit"
+        return cached, list(route["used_dictionaries"])
+    timings["cache"] = "miss"
+    remembered, route = consult_translation_memory(route, text, timings)
+    if remembered is not None:
+        translation_cache.set(cache_key, remembered)
+        return remembered, list(route["used_dictionaries"])
+
+    async def fetch():
+        flight_timings = {}
+        translated_text_raw, used_dictionaries, cacheable = await call_upstream(route, text, flight_timings, deadline)
+        if cacheable:
+            store_translation(route, text, cache_key, translated_text_raw)
+        return translated_text_raw, used_dictionaries, flight_timings
+
+    translated_text_raw, used_dictionaries, flight_timings, coalesced = await single_flight.do(cache_key, fetch)
+    timings.update(flight_timings)
+    if coalesced:
+        timings["coalesced"] = True
+    return translated_text_raw, list(used_dictionaries)
+
+async def translate_raw_stream(text, original_english_text, timings, result):
+    """Streaming counterpart of translate_raw, yielding raw translation text as it arrives.
+
+    Gemini chunks are forwarded as the model produces them; cache hits, Cloud
+    Translation results and results shared from an identical in-flight request
+    arrive as a single piece. The upstream used_dictionaries entries are stored
+    in ``result`` once the stream has finished.
+    """
+    route = resolve_translation_route(text, original_english_text)
+    cache_key = translation_cache_key(route, text)
+    cached = await translation_cache.lookup(cache_key)
+    if cached is not None:
+        timings["cache"] = "hit"
+        result["used_dictionaries"] = list(route["used_dictionaries"])
+        yield cached
+        return
+    timings["cache"] = "miss"
+    remembered, route = consult_translation_memory(route, text, timings)
+    if remembered is not None:
+        translation_cache.set(cache_key, remembered)
+        result["used_dictionaries"] = list(route["used_dictionaries"])
+        yield remembered
+        return
+
+    joined = await single_flight.join(cache_key)
+    if joined is not None:
+        translated_text_raw, used_dictionaries, flight_timings = joined
+        timings.update(flight_timings)
+        timings["coalesced"] = True
+        result["used_dictionaries"] = list(used_dictionaries)
+        yield translated_text_raw
+        return
+
+    flight = single_flight.lead(cache_key)
+    try:
+        async for piece in _stream_upstream_route(route, text, cache_key, timings, result):
+            yield piece
+    except BaseException as e:
+        if not flight.done():
+            if not isinstance(e, Exception):
+                # The leading client went away; followers should not inherit its cancellation
+                e = HTTPException(status_code=503, detail="Translation was interrupted, please retry.")
+            flight.set_exception(e)
+            flight.exception()  # followers re-raise it; avoid "never retrieved" warnings
+        raise
+    if not flight.done():
+        # Followers get their own copy; the leader's caller appends its applied dictionaries to its list
+        flight.set_result((result["raw"], list(result["used_dictionaries"]), dict(timings)))
+
+async def _stream_upstream_route(route, text, cache_key, timings, result):
+    if route["backend"] == "cloud":
+        translated_text_raw, used_dictionaries, cacheable = await call_upstream(route, text, timings)
+        if cacheable:
+            store_translation(route, text, cache_key, translated_text_raw)
+        result["raw"] = translated_text_raw
+        result["used_dictionaries"] = used_dictionaries
+        yield translated_text_raw
+        return
+
+    log_event("upstream_call", backend="gemini", mode="ai" if route["mode"] == "ai" else "keyword", model=route["model"], streaming=True)
+    pieces = []
+    try:
+        async for piece in stream_upstream(
+            gemini_generate_stream, route["model"], route["prompt"], route["system_instruction"],
+            timings=timings, backend="gemini", model=route["model"]
+        ):
+            pieces.append(piece)
+            yield piece
+    except Exception as e:
+        # Keyword-prompt requests fall back to Cloud Translation only if nothing was sent yet
+        if route["mode"] == "ai" or pieces or (isinstance(e, HTTPException) and e.status_code == 503):
+            if isinstance(e, HTTPException):
+                raise
+            log_event("translation_failed", level="error", backend="gemini", streaming=True, error=str(e))
+            raise HTTPException(status_code=500, detail="An error occurred during translation with Gemini.")
+        log_event("translation_failed", level="warning", backend="gemini", streaming=True, error=str(e))
+        translated_text_raw = await cloud_fallback(text, timings)
+        result["raw"] = translated_text_raw
+        result["used_dictionaries"] = []
+        yield translated_text_raw
+        return
+
+    result["raw"] = "".join(pieces)
+    result["used_dictionaries"] = list(route["used_dictionaries"])
+    store_translation(route, text, cache_key, result["raw"])
+
+GEMINI_BATCH_INSTRUCTION = (
+    "The input contains several numbered segments. Each segment starts with a marker line such as [[SEGMENT 1]]. "
+    "Translate every segment separately and output each translation under its original marker line, "
+    "keeping the marker lines exactly as they are."
+)
+_segment_marker_re = re.compile(r"^[ \t]*\[\[SEGMENT (\d+)\]\][ \t]*$", re.MULTILINE)
+
+def pack_segments(items, size_of, max_chars=None, max_segments=None):
+    """Greedily split items into consecutive groups within a character and segment budget"""
+    max_chars = max_chars or BATCH_MAX_CHARS
+    max_segments = max_segments or BATCH_MAX_SEGMENTS
+    groups = []
+    current = []
+    current_chars = 0
+    for item in items:
+        size = size_of(item)
+        if current and (len(current) >= max_segments or current_chars + size > max_chars):
+            groups.append(current)
+            current = []
+            current_chars = 0
+        current.append(item)
+        current_chars += size
+    if current:
+        groups.append(current)
+    return groups
+
+def build_gemini_batch_text(texts):
+    return "\n".join(f"[[SEGMENT {number}]]\n{text}" for number, text in enumerate(texts, start=1))
+
+def parse_gemini_batch_text(raw, count):
+    """Split a multi-segment Gemini response back into segments, or None if markers are missing"""
+    parts = _segment_marker_re.split(raw)
+    numbers = parts[1::2]
+    if numbers != [str(number) for number in range(1, count + 1)]:
+        return None
+    return [part.strip() for part in parts[2::2]]
+
+async def _translate_batch_group(group, timings):
+    """Translate one packed group of (text, route) pairs that share a route.
+
+    Returns (raw, used_dictionaries, cacheable) per item, in order.
+    """
+    route = group[0][1]
+    texts = [text for text, _ in group]
+    if len(group) == 1:
+        return [await call_upstream(route, texts[0], timings)]
+
+    if route["backend"] == "cloud":
+        translation_client = get_google_cloud_client()
+        if not translation_client:
+            raise HTTPException(status_code=500, detail="Translation service unavailable.")
+        log_event("upstream_call", backend="cloud", segments=len(texts))
+        try:
+            raws = await run_upstream(cloud_translate_batch, translation_client, texts, timings=timings, backend="cloud_batch")
+        except HTTPException:
+            raise
+        except Exception as e:
+            log_event("translation_failed", level="error", backend="cloud", segments=len(texts), error=str(e))
+            raise HTTPException(status_code=500, detail="An error occurred during translation.")
+        return [(raw, [], True) for raw in raws]
+
+    batch_text = build_gemini_batch_text(texts)
+    if route["mode"] == "ai":
+        prompt = batch_text
+        system_instruction = f"{route['system_instruction']}\n\n{GEMINI_BATCH_INSTRUCTION}"
+    else:
+        prompt = f"{route['general_prompt']}\n\n{route['keyword_prompt']}\n\n{GEMINI_BATCH_INSTRUCTION}\n\nTranslate the following text to Bengali:\n{batch_text}"
+        system_instruction = None
+
+    log_event("upstream_call", backend="gemini", mode=route["mode"], model=route["model"], segments=len(texts))
+    try:
+        raw = await run_upstream(
+            gemini_generate, route["model"], prompt, system_instruction, timings=timings, backend="gemini_batch", model=route["model"]
+        )
+    except Exception as e:
+        if route["mode"] == "ai" or (isinstance(e, HTTPException) and e.status_code == 503):
+            if isinstance(e, HTTPException):
+                raise
+            log_event("translation_failed", level="error", backend="gemini", mode="ai", segments=len(texts), error=str(e))
+            raise HTTPException(status_code=500, detail="An error occurred during AI Mode translation with Gemini.")
+        log_event("translation_failed", level="warning", backend="gemini", segments=len(texts), error=str(e))
+        # Fallback to Google Cloud Translation if Gemini fails; fallback results are not cached
+        fallback_client = get_google_cloud_client()
+        if not fallback_client:
+            raise HTTPException(status_code=500, detail="Translation service unavailable.")
+        log_event("upstream_fallback", backend="cloud", segments=len(texts))
+        try:
+            raws = await run_upstream(cloud_translate_batch, fallback_client, texts, timings=timings, backend="cloud_batch")
+        except HTTPException:
+            raise
+        except Exception as e:
+            log_event("translation_failed", level="error", backend="cloud", stage="fallback", segments=len(texts), error=str(e))
+            raise HTTPException(status_code=500, detail="An error occurred during translation.")
+        return [(raw, [], False) for raw in raws]
+
+    parsed = parse_gemini_batch_text(raw, len(texts))
+    if parsed is None:
+        # Markers were lost: translate the segments one by one
+        log_event("batch_split_failed", level="warning", model=route["model"], segments=len(texts))
+        return list(await asyncio.gather(*(call_upstream(route, text, timings) for text in texts)))
+    return [(text, list(route["used_dictionaries"]), True) for text in parsed]
+
+async def translate_raw_batch(segments, timings):
+    """Raw translations for many (text, original_english_text) pairs.
+
+    Cached segments and direct translation memory hits are served directly;
+    the rest are grouped by route and packed into as few upstream calls as
+    the batch budgets allow. Each result is (raw, used_dictionaries, error).
+    """
+    results = [None] * len(segments)
+    pending = {}
+    for index, (text, original_english_text) in enumerate(segments):
+        if not text.strip():
+            results[index] = ("", [], None)
+            continue
+        route = resolve_translation_route(text, original_english_text)
+        cache_key = translation_cache_key(route, text)
+        cached = await translation_cache.lookup(cache_key)
+        if cached is not None:
+            results[index] = (cached, list(route["used_dictionaries"]), None)
+            continue
+        # Packed segments share one prompt, so only direct translation memory hits apply here
+        remembered, route = consult_translation_memory(route, text, {}, allow_reference=False)
+        if remembered is not None:
+            translation_cache.set(cache_key, remembered)
+            results[index] = (remembered, list(route["used_dictionaries"]), None)
+            continue
+        group_key = (route["mode"], route["backend"], route["model"], route["keyword_prompt"])
+        pending.setdefault(group_key, []).append((index, text, route, cache_key))
+
+    packed = []
+    for items in pending.values():
+        packed.extend(pack_segments(items, lambda item: len(item[1])))
+    timings["upstream_calls"] = len(packed)
+
+    group_results = await asyncio.gather(
+        *(_translate_batch_group([(text, route) for _, text, route, _ in group], timings) for group in packed),
+        return_exceptions=True
+    )
+    for group, outcome in zip(packed, group_results):
+        if isinstance(outcome, BaseException):
+            detail = outcome.detail if isinstance(outcome, HTTPException) else "An error occurred during translation."
+            for index, _, _, _ in group:
+                results[index] = (None, [], detail)
+            continue
+        for (index, text, route, cache_key), (raw, used_dictionaries, cacheable) in zip(group, outcome):
+            if cacheable:
+                store_translation(route, text, cache_key, raw)
+            results[index] = (raw, used_dictionaries, None)
+    return results
+
+class TranslationRequest(BaseModel):
+    text: str
+    original_english_text: str
+    deadline_ms: Optional[int] = None
+
+class BatchTranslationRequest(BaseModel):
+    segments: List[TranslationRequest]
+
+class SegmentTranslationRequest(BaseModel):
+    text: str
+    original_english_text: str
+    session_id: str
+
+# Last rendered index page: re-rendered only when the prompt or settings it shows change
+_index_page = {"key": None, "variants": None, "etag": None}
+
+def rendered_index_page():
+    settings = dictionaries_cache["settings"]
+    context = {
+        "general_prompt": general_prompt_cache,
+        "ai_mode_enabled": settings.get("ai_mode_enabled", False),
+        "api_keys": settings.get("api_keys", []),
+        "model_names": settings.get("model_names", [])
+    }
+    key = json.dumps(context, sort_keys=True)
+    if _index_page["key"] != key:
+        body = templates.get_template("index.html").render(context).encode("utf-8")
+        _index_page.update(
+            key=key,
+            variants=compressed_variants(body, "text/html"),
+            etag=f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        )
+    return _index_page
+
+@app.get("/", response_class=HTMLResponse)
+async def read_root(request: Request):
+    """Root endpoint that serves the main application and acts as a health check"""
+    try:
+        page = rendered_index_page()
+        return variant_response(request, page["variants"], "text/html", page["etag"], "no-cache")
+    except Exception as e:
+        print(f"ERROR: Root endpoint error: {e}")
+        # Return a simple HTML response if template fails
+        return HTMLResponse(
+            content="""
+            <html>
+                <head><title>Fast Translation Webapp</title></head>
+                <body>
+                    <h1>Fast Translation Webapp</h1>
+                    <p>Service is running but template loading failed.</p>
+                    <p>Error: """ + str(e) + """</p>
+                </body>
+            </html>
+            """,
+            status_code=200
+        )
+
+def prepare_translation_services():
+    """Check the upstream SDKs are importable and a Gemini API key is configured"""
+    # Get required modules
+    genai = get_genai()
+    types = get_types()
+    
+    if not genai or not types:
+        raise HTTPException(status_code=500, detail="Translation services not available.")
+
+    # Calls are spread over every stored key by api_key_scheduler
+    if not api_key_scheduler.configured_keys():
+        raise HTTPException(status_code=400, detail="No Gemini API key configured.")
+
+@app.post("/translate")
+async def translate_text(translation_request: TranslationRequest):
+    timings = {}
+
+    if not translation_request.text.strip():
+        raise HTTPException(status_code=400, detail="Input text cannot be empty.")
+
+    prepare_translation_services()
+
+    translated_text_raw, used_dictionaries = await translate_raw(
+        translation_request.text,
+        translation_request.original_english_text,
+        timings,
+        deadline=translation_request.deadline_ms / 1000 if translation_request.deadline_ms else None
+    )
+
+    # Apply dictionaries and get used entries
+    translated_text_with_dicts, applied_dicts = apply_dictionaries(
+        translated_text_raw,
+        dictionaries_cache,
+        translation_request.original_english_text
+    )
+    used_dictionaries.extend(applied_dicts)
+    
+    return {"translation": translated_text_with_dicts, "used_dictionaries": used_dictionaries, "timings": timings}
+
+_segment_split_re = re.compile(r"(\n\s*|(?<=[.!?\u0964])[ \t]+)")
+
+def split_segments(text):
+    """Split text into sentence/paragraph segments and the separators between them.
+
+    Returns a list alternating segment, separator, segment, ... so that
+    "".join() gives back the original text.
+    """
+    return _segment_split_re.split(text)
+
+class SegmentSessionStore:
+    """Per-editor-session raw translations of the segments in the latest document version"""
+
+    def __init__(self, max_sessions, ttl):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.stats = {"segments_reused": 0, "segments_translated": 0}
+
+    def get(self, session_id):
+        now = time.time()
+        session = self.sessions.get(session_id)
+        if session is None or now - session["touched"] > self.ttl:
+            session = {"segments": {}, "touched": now}
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        session["touched"] = now
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return session["segments"]
+
+    def replace(self, session_id, segments):
+        """Keep only the segments of the current document so sessions stay bounded"""
+        if session_id in self.sessions:
+            self.sessions[session_id]["segments"] = segments
+
+    def snapshot(self):
+        return {**self.stats, "sessions": len(self.sessions), "max_sessions": self.max_sessions}
+
+segment_sessions = SegmentSessionStore(SEGMENT_SESSIONS_MAX, SEGMENT_SESSION_TTL)
+
+@app.post("/translate/segments")
+async def translate_segments(segment_request: SegmentTranslationRequest):
+    """Incremental translation for the live editor.
+
+    The text is split into sentences, each fingerprinted by its translation
+    cache key; only segments that are new or changed since the session's
+    previous request go upstream (packed like /translate/batch). Dictionaries
+    are applied per segment and the results are stitched back together.
+    """
+    timings = {}
+    if not segment_request.text.strip():
+        raise HTTPException(status_code=400, detail="Input text cannot be empty.")
+    prepare_translation_services()
+
+    # Keyword prompts and keyword_based entries match the whole English source, exactly like /translate
+    english_text = segment_request.original_english_text
+    parts = split_segments(segment_request.text)
+    previous = segment_sessions.get(segment_request.session_id)
+    current = {}
+    fingerprints = {}
+    missing = []
+    for index in range(0, len(parts), 2):
+        segment = parts[index]
+        if not segment.strip():
+            continue
+        route = resolve_translation_route(segment, english_text)
+        fingerprint = translation_cache_key(route, segment)
+        fingerprints[index] = fingerprint
+        if fingerprint in previous:
+            current[fingerprint] = previous[fingerprint]
+        elif fingerprint not in current:
+            current[fingerprint] = None
+            missing.append((fingerprint, segment))
+
+    if missing:
+        raw_results = await translate_raw_batch([(segment, english_text) for _, segment in missing], timings)
+        for (fingerprint, _), (translated_text_raw, used_dictionaries, error) in zip(missing, raw_results):
+            if error is not None:
+                raise HTTPException(status_code=500, detail=error)
+            current[fingerprint] = (translated_text_raw, used_dictionaries)
+
+    reused = len(fingerprints) - len(missing)
+    segment_sessions.stats["segments_reused"] += reused
+    segment_sessions.stats["segments_translated"] += len(missing)
+    segment_sessions.replace(segment_request.session_id, current)
+
+    pieces = []
+    used_dictionaries = []
+    seen_prompts = set()
+    for index, part in enumerate(parts):
+        if index not in fingerprints:
+            pieces.append(part)
+            continue
+        translated_text_raw, segment_used = current[fingerprints[index]]
+        translated_text_with_dicts, applied_dicts = apply_dictionaries(translated_text_raw, dictionaries_cache, english_text)
+        pieces.append(translated_text_with_dicts)
+        # Prompt entries describe the request rather than an occurrence; list each once
+        for entry in segment_used:
+            marker = json.dumps(entry, sort_keys=True)
+            if marker not in seen_prompts:
+                seen_prompts.add(marker)
+                used_dictionaries.append(entry)
+        used_dictionaries.extend(applied_dicts)
+
+    return {
+        "translation": "".join(pieces),
+        "used_dictionaries": used_dictionaries,
+        "segments": {"total": len(fingerprints), "translated": len(missing), "reused": reused},
+        "timings": timings
+    }
+
+def _ndjson(event):
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+def _split_completed_span(pending, english_text):
+    """Split buffered text at whitespace so dictionary matches, including multi-word keys
+    that could still be completed by later pieces, never straddle a chunk"""
+    cut = get_compiled_dictionaries().split_point(pending, english_text)
+    return pending[:cut], pending[cut:]
+
+async def translation_events(translation_request):
+    """Events for /translate/stream and /ws/translate: chunk events with dictionary-applied
+    spans, then a done event carrying the full translation and used_dictionaries"""
+    timings = {}
+    result = {}
+    raw_pieces = []
+    pending = ""
+    english_text = translation_request.original_english_text
+    try:
+        async for piece in translate_raw_stream(translation_request.text, english_text, timings, result):
+            raw_pieces.append(piece)
+            completed, pending = _split_completed_span(pending + piece, english_text)
+            if completed:
+                yield {"type": "chunk", "text": apply_dictionaries(completed, dictionaries_cache, english_text)[0]}
+        if pending:
+            yield {"type": "chunk", "text": apply_dictionaries(pending, dictionaries_cache, english_text)[0]}
+    except HTTPException as e:
+        yield {"type": "error", "status": e.status_code, "detail": e.detail}
+        return
+    except Exception as e:
+        log_event("translation_failed", level="error", streaming=True, error=str(e))
+        yield {"type": "error", "status": 500, "detail": "An error occurred during translation."}
+        return
+
+    # The final event is computed over the whole text, exactly like /translate
+    translated_text_with_dicts, applied_dicts = apply_dictionaries("".join(raw_pieces), dictionaries_cache, english_text)
+    used_dictionaries = list(result.get("used_dictionaries", [])) + applied_dicts
+    yield {"type": "done", "translation": translated_text_with_dicts, "used_dictionaries": used_dictionaries, "timings": timings}
+
+async def stream_translation_events(translation_request):
+    async for event in translation_events(translation_request):
+        yield _ndjson(event)
+
+@app.post("/translate/stream")
+async def translate_text_stream(translation_request: TranslationRequest):
+    if not translation_request.text.strip():
+        raise HTTPException(status_code=400, detail="Input text cannot be empty.")
+
+    prepare_translation_services()
+
+    return StreamingResponse(
+        stream_translation_events(translation_request),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _run_websocket_translation(send, session_id, seq, message):
+    """One translate message of /ws/translate, replying with events tagged by ``seq``"""
+    text = message.get("text")
+    english_text = message.get("original_english_text", text)
+    if not isinstance(text, str) or not text.strip() or not isinstance(english_text, str):
+        await send({"seq": seq, "type": "error", "status": 400, "detail": "Input text cannot be empty."})
+        return
+    try:
+        prepare_translation_services()
+        if message.get("incremental"):
+            data = await translate_segments(SegmentTranslationRequest(
+                text=text, original_english_text=english_text, session_id=session_id
+            ))
+            await send({"seq": seq, "type": "done", **data})
+        else:
+            deadline_ms = message.get("deadline_ms")
+            translation_request = TranslationRequest(
+                text=text, original_english_text=english_text,
+                deadline_ms=deadline_ms if isinstance(deadline_ms, int) else None
+            )
+            async for event in translation_events(translation_request):
+                await send({"seq": seq, **event})
+        metrics.inc("websocket_translations_total", result="completed")
+    except HTTPException as e:
+        metrics.inc("websocket_translations_total", result="error")
+        await send({"seq": seq, "type": "error", "status": e.status_code, "detail": e.detail})
+    except asyncio.CancelledError:
+        metrics.inc("websocket_translations_total", result="cancelled")
+        raise
+    except Exception as e:
+        metrics.inc("websocket_translations_total", result="error")
+        log_event("translation_failed", level="error", websocket=True, error=str(e))
+        await send({"seq": seq, "type": "error", "status": 500, "detail": "An error occurred during translation."})
+
+@app.websocket("/ws/translate")
+async def translate_websocket(websocket: WebSocket):
+    """Live-translation channel for one editor session.
+
+    Clients send ``{"type": "translate", "seq": n, "text", "original_english_text",
+    "incremental"}``; a new message cancels the session's in-flight translation
+    (its Gemini stream or Cloud Translation call included), as does
+    ``{"type": "cancel"}``. Replies are the /translate/stream events, or one done
+    event for incremental requests, each tagged with the request's ``seq``.
+    """
+    await websocket.accept()
+    session_id = websocket.query_params.get("session_id") or uuid.uuid4().hex
+    send_lock = asyncio.Lock()
+    current = {"seq": None, "task": None, "release": None}
+    client = _admission_context.get()[0] or "ip:unknown"
+    held_slots = set()  # release functions of per-client slots not yet returned
+
+    async def send(event):
+        async with send_lock:
+            await websocket.send_text(json.dumps(event, ensure_ascii=False))
+
+    def client_slot():
+        """Release function for one per-client slot; only the first call returns it"""
+        def release():
+            if release in held_slots:
+                held_slots.discard(release)
+                client_limiter.exit(client)
+        held_slots.add(release)
+        return release
+
+    async def run_translation(seq, message, release):
+        try:
+            await _run_websocket_translation(send, session_id, seq, message)
+        finally:
+            release()
+
+    async def cancel_current():
+        task = current["task"]
+        if task is not None and not task.done():
+            task.cancel()
+            # A task cancelled before it started never reaches its finally
+            current["release"]()
+            await send({"seq": current["seq"], "type": "cancelled"})
+        current["task"] = None
+
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except ValueError:
+                await send({"seq": None, "type": "error", "status": 400, "detail": "Messages must be JSON objects."})
+                continue
+            if not isinstance(message, dict):
+                await send({"seq": None, "type": "error", "status": 400, "detail": "Messages must be JSON objects."})
+                continue
+            message_type = message.get("type", "translate")
+            if message_type == "cancel":
+                await cancel_current()
+            elif message_type == "translate":
+                await cancel_current()
+                current["seq"] = message.get("seq")
+                try:
+                    client_limiter.enter(client)
+                except HTTPException as e:
+                    await send({
+                        "seq": current["seq"], "type": "error", "status": e.status_code, "detail": e.detail,
+                        "retry_after": int(e.headers["Retry-After"])
+                    })
+                    continue
+                release = client_slot()
+                current["task"] = asyncio.ensure_future(run_translation(current["seq"], message, release))
+                current["release"] = release
+            else:
+                await send({"seq": message.get("seq"), "type": "error", "status": 400, "detail": f"Unknown message type '{message_type}'."})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        task = current["task"]
+        if task is not None and not task.done():
+            task.cancel()
+        for release in list(held_slots):
+            release()
+
+@app.post("/translate/batch")
+async def translate_batch(batch_request: BatchTranslationRequest):
+    timings = {}
+    if not batch_request.segments:
+        raise HTTPException(status_code=400, detail="At least one segment is required.")
+    prepare_translation_services()
+
+    raw_results = await translate_raw_batch(
+        [(segment.text, segment.original_english_text) for segment in batch_request.segments],
+        timings
+    )
+
+    translations = []
+    for segment, (translated_text_raw, used_dictionaries, error) in zip(batch_request.segments, raw_results):
+        if error is not None:
+            translations.append({"translation": None, "used_dictionaries": [], "error": error})
+            continue
+        translated_text_with_dicts, applied_dicts = apply_dictionaries(
+            translated_text_raw,
+            dictionaries_cache,
+            segment.original_english_text
+        )
+        used_dictionaries.extend(applied_dicts)
+        translations.append({"translation": translated_text_with_dicts, "used_dictionaries": used_dictionaries})
+
+    return {"translations": translations, "timings": timings}
+
+JOB_FORMATS = ("txt", "srt", "jsonl")
+_dictionary_highlight_re = re.compile(r'<span style="color:red">(.*?)</span>', re.DOTALL)
+_job_tasks = {}
+
+def _job_dir(job_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return os.path.join(JOBS_DIR, job_id)
+
+def _write_json_atomic(path, data):
+    # A unique temp file per write, so concurrent writers never clobber each other's
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path),
+                                     prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+        try:
+            json.dump(data, f, ensure_ascii=False)
+        except BaseException:
+            f.close()
+            os.unlink(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def parse_job_input(content, job_format):
+    """Split an uploaded document into translatable units plus the layout needed to rebuild it"""
+    content = content.replace("\r\n", "\n")
+    units = []
+    if job_format == "txt":
+        # Paragraphs are the units; the blank-line separators are kept verbatim
+        layout = re.split(r"(\n[ \t]*\n\s*)", content)
+        for index in range(0, len(layout), 2):
+            if layout[index].strip():
+                units.append({"part": index, "text": layout[index], "original_english_text": layout[index]})
+    elif job_format == "srt":
+        layout = []
+        for block in re.split(r"\n[ \t]*\n", content.strip()):
+            lines = block.split("\n")
+            if len(lines) < 2 or "-->" not in lines[1]:
+                raise HTTPException(status_code=400, detail=f"Invalid SRT block: {block[:50]!r}")
+            text = "\n".join(lines[2:])
+            layout.append(lines[:2])
+            units.append({"part": len(layout) - 1, "text": text, "original_english_text": text})
+    elif job_format == "jsonl":
+        layout = []
+        for line_number, line in enumerate(content.split("\n"), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid JSON on line {line_number}.")
+            if not isinstance(record, dict) or not isinstance(record.get("text"), str):
+                raise HTTPException(status_code=400, detail=f"Line {line_number} needs a string \"text\" field.")
+            layout.append(record)
+            units.append({
+                "part": len(layout) - 1,
+                "text": record["text"],
+                "original_english_text": record.get("original_english_text") or record["text"],
+            })
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported job format, use one of: {', '.join(JOB_FORMATS)}.")
+    return units, layout
+
+def chunk_job_units(units):
+    """Group units into chunks within the JOB_CHUNK_CHARS / JOB_CHUNK_UNITS budgets"""
+    indexes = list(range(len(units)))
+    return pack_segments(indexes, lambda index: len(units[index]["text"]), JOB_CHUNK_CHARS, JOB_CHUNK_UNITS)
+
+def job_status(job_id):
+    job_dir = _job_dir(job_id)
+    try:
+        meta = _read_json(os.path.join(job_dir, "job.json"))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    completed = len([name for name in os.listdir(os.path.join(job_dir, "chunks")) if name.endswith(".json")])
+    meta["completed_chunks"] = completed
+    meta["progress"] = round(completed / meta["total_chunks"], 4) if meta["total_chunks"] else 1.0
+    return meta
+
+def _update_job(job_id, **changes):
+    path = os.path.join(_job_dir(job_id), "job.json")
+    meta = _read_json(path)
+    meta.update(changes, updated_at=time.time())
+    _write_json_atomic(path, meta)
+
+async def _translate_job_chunk(job_id, chunk_index, unit_indexes, units):
+    """Translate one chunk (with retries) and store it on disk; finished chunks are skipped"""
+    chunk_path = os.path.join(_job_dir(job_id), "chunks", f"{chunk_index}.json")
+    if os.path.exists(chunk_path):
+        return
+    segments = [(units[index]["text"], units[index]["original_english_text"]) for index in unit_indexes]
+    for attempt in range(JOB_CHUNK_RETRIES + 1):
+        raw_results = await translate_raw_batch(segments, {})
+        errors = [error for _, _, error in raw_results if error is not None]
+        if not errors:
+            break
+        if attempt == JOB_CHUNK_RETRIES:
+            raise RuntimeError(errors[0])
+        await asyncio.sleep(2 ** attempt)
+
+    translations = []
+    for (text, english_text), (translated_text_raw, used_dictionaries, _) in zip(segments, raw_results):
+        translated_text_with_dicts, applied_dicts = apply_dictionaries(translated_text_raw, dictionaries_cache, english_text)
+        translations.append({"translation": translated_text_with_dicts, "used_dictionaries": used_dictionaries + applied_dicts})
+    _write_json_atomic(chunk_path, {"units": unit_indexes, "translations": translations})
+
+async def run_job(job_id):
+    """Translate every missing chunk of a job with at most JOB_CONCURRENCY chunks in flight"""
+    job_dir = _job_dir(job_id)
+    units = _read_json(os.path.join(job_dir, "input.json"))["units"]
+    chunks = chunk_job_units(units)
+    semaphore = asyncio.Semaphore(JOB_CONCURRENCY)
+    _admission_context.set(("jobs", "bulk"))  # this task's own context; resumed jobs have no request
+
+    async def run_chunk(chunk_index, unit_indexes):
+        async with semaphore:
+            await _translate_job_chunk(job_id, chunk_index, unit_indexes, units)
+
+    _update_job(job_id, status="running")
+    tasks = [asyncio.ensure_future(run_chunk(index, unit_indexes)) for index, unit_indexes in enumerate(chunks)]
+    try:
+        if tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+    except BaseException as e:
+        # Stop the remaining chunks before the job is marked failed and its lock is released,
+        # so a resume never overlaps chunks of this run
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _job_tasks.pop(job_id, None)
+        if not isinstance(e, Exception):
+            raise
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        print(f"ERROR: Job {job_id} failed: {detail}")
+        _update_job(job_id, status="failed", error=detail)
+        return
+    _job_tasks.pop(job_id, None)
+    _update_job(job_id, status="completed", error=None)
+    print(f"INFO: Job {job_id} completed ({len(chunks)} chunks)")
+
+def _claim_job(job_id):
+    """Take an exclusive lock on a job so only one worker runs it; returns the lock file or None"""
+    lock_file = open(os.path.join(_job_dir(job_id), "job.lock"), "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+def start_job(job_id):
+    if job_id in _job_tasks:
+        return
+    lock_file = _claim_job(job_id)
+    if lock_file is None:
+        return  # another worker is running it
+    task = asyncio.get_running_loop().create_task(run_job(job_id))
+    task.add_done_callback(lambda _task: lock_file.close())
+    _job_tasks[job_id] = task
+
+def resume_jobs():
+    """Restart jobs that were queued or running when the process stopped"""
+    if not os.path.isdir(JOBS_DIR):
+        return
+    for job_id in os.listdir(JOBS_DIR):
+        try:
+            meta = _read_json(os.path.join(JOBS_DIR, job_id, "job.json"))
+        except (OSError, ValueError):
+            continue
+        if meta.get("status") in ("queued", "running"):
+            print(f"INFO: Resuming job {job_id}")
+            start_job(job_id)
+
+def _job_result_lines(job_id, meta):
+    job_dir = _job_dir(job_id)
+    job_input = _read_json(os.path.join(job_dir, "input.json"))
+    layout, units = job_input["layout"], job_input["units"]
+    translated = {}
+    for chunk_index in range(meta["total_chunks"]):
+        chunk = _read_json(os.path.join(job_dir, "chunks", f"{chunk_index}.json"))
+        for unit_index, translation in zip(chunk["units"], chunk["translations"]):
+            translated[units[unit_index]["part"]] = translation
+
+    job_format = meta["format"]
+    if job_format == "txt":
+        for index, part in enumerate(layout):
+            if index in translated:
+                yield _dictionary_highlight_re.sub(r"\1", translated[index]["translation"])
+            else:
+                yield part
+    elif job_format == "srt":
+        for index, header in enumerate(layout):
+            text = _dictionary_highlight_re.sub(r"\1", translated[index]["translation"])
+            yield "\n".join(header + [text]) + "\n\n"
+    else:
+        for index, record in enumerate(layout):
+            translation = translated[index]
+            yield json.dumps({
+                **record,
+                "translation": _dictionary_highlight_re.sub(r"\1", translation["translation"]),
+                "used_dictionaries": translation["used_dictionaries"],
+            }, ensure_ascii=False) + "\n"
+
+@app.post("/jobs")
+async def create_job(file: UploadFile = File(...), format: str = Form(None)):
+    """Queue a txt, SRT or JSONL document for background translation"""
+    job_format = (format or os.path.splitext(file.filename or "")[1].lstrip(".")).lower()
+    if job_format not in JOB_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported job format, use one of: {', '.join(JOB_FORMATS)}.")
+    data = await file.read(JOB_MAX_BYTES + 1)
+    if len(data) > JOB_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Document is too large.")
+    try:
+        content = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Document must be UTF-8 encoded.")
+    prepare_translation_services()
+
+    units, layout = parse_job_input(content, job_format)
+    if not units:
+        raise HTTPException(status_code=400, detail="Document contains no text to translate.")
+
+    job_id = uuid.uuid4().hex
+    job_dir = _job_dir(job_id)
+    os.makedirs(os.path.join(job_dir, "chunks"))
+    _write_json_atomic(os.path.join(job_dir, "input.json"), {"units": units, "layout": layout})
+    now = time.time()
+    _write_json_atomic(os.path.join(job_dir, "job.json"), {
+        "id": job_id,
+        "format": job_format,
+        "filename": file.filename,
+        "status": "queued",
+        "total_units": len(units),
+        "total_chunks": len(chunk_job_units(units)),
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    })
+    start_job(job_id)
+    return job_status(job_id)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return job_status(job_id)
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    """Retry a failed job; chunks that already finished are not translated again"""
+    meta = job_status(job_id)
+    if meta["status"] == "completed":
+        return meta
+    prepare_translation_services()
+    _update_job(job_id, status="queued", error=None)
+    start_job(job_id)
+    return job_status(job_id)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    meta = job_status(job_id)
+    if meta["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {meta['status']}.")
+    media_types = {"txt": "text/plain; charset=utf-8", "srt": "application/x-subrip; charset=utf-8", "jsonl": "application/x-ndjson"}
+    filename = f"{os.path.splitext(meta.get('filename') or job_id)[0]}.bn.{meta['format']}"
+    return StreamingResponse(
+        _job_result_lines(job_id, meta),
+        media_type=media_types[meta["format"]],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return {
+        **translation_cache.snapshot(),
+        "translation_memory": translation_memory.snapshot(),
+        "single_flight": single_flight.snapshot(),
+        "segment_sessions": segment_sessions.snapshot()
+    }
+
+@metrics.collector
+def collect_service_metrics():
+    families = [
+        ("upstream_pending_calls", "gauge", "Upstream calls running or waiting for a worker", [({}, _upstream_pending)]),
+    ]
+    cache = translation_cache.snapshot()
+    families.append(("translation_cache_events_total", "counter", "Translation cache lookups and evictions",
+                     [({"event": event}, cache[event]) for event in ("hits", "misses", "evictions", "expired", "disk_hits")]))
+    families.append(("translation_cache_entries", "gauge", "Translations held in the in-memory cache", [({}, cache["entries"])]))
+    memory = translation_memory.snapshot()
+    families.append(("translation_memory_lookups_total", "counter", "Translation memory lookups by outcome",
+                     [({"result": "direct"}, memory["direct_hits"]), ({"result": "reference"}, memory["reference_hits"]),
+                      ({"result": "miss"}, memory["misses"])]))
+    families.append(("translation_memory_entries", "gauge", "Source texts held in the translation memory", [({}, memory["entries"])]))
+    flights = single_flight.snapshot()
+    families.append(("single_flight_calls_total", "counter", "Upstream calls started and requests coalesced onto them",
+                     [({"result": "called"}, flights["calls"]), ({"result": "coalesced"}, flights["coalesced"])]))
+    sessions = segment_sessions.snapshot()
+    families.append(("segment_translations_total", "counter", "Editor segments reused from a session or sent upstream",
+                     [({"result": "reused"}, sessions["segments_reused"]), ({"result": "translated"}, sessions["segments_translated"])]))
+    pool = gemini_model_pool.snapshot()
+    families.append(("gemini_model_pool_events_total", "counter", "Gemini model pool lookups and evictions",
+                     [({"event": event}, pool[event]) for event in ("hits", "misses", "evictions")]))
+    keys = api_key_scheduler.snapshot()["keys"]
+    for name, help_text in (("requests", "Gemini requests sent per API key"), ("rate_limited", "Quota errors per Gemini API key")):
+        families.append((f"gemini_key_{name}_total", "counter", help_text, [({"key": usage["key"]}, usage[name]) for usage in keys]))
+    families.append(("gemini_key_in_flight", "gauge", "Gemini calls in flight per API key",
+                     [({"key": usage["key"]}, usage["in_flight"]) for usage in keys]))
+    families.append(("gemini_key_cooldown_seconds", "gauge", "Remaining cooldown per Gemini API key",
+                     [({"key": usage["key"]}, usage["cooldown_remaining"]) for usage in keys]))
+    admission = upstream_admission.snapshot()
+    lanes = admission["lanes"]
+    families.append(("admission_in_flight", "gauge", "Upstream calls holding an admission slot", [({}, admission["in_flight"])]))
+    families.append(("admission_queue_length", "gauge", "Upstream calls waiting for admission per lane",
+                     [({"lane": lane}, stats["waiting"]) for lane, stats in lanes.items()]))
+    families.append(("admission_requests_total", "counter", "Upstream admission outcomes per lane",
+                     [({"lane": lane, "result": result}, stats[result])
+                      for lane, stats in lanes.items() for result in ("admitted", "rejected", "timed_out")]))
+    with _startup_lock:
+        phases = dict(startup_state["phases"])
+    families.append(("startup_phase_seconds", "gauge", "Duration of each startup import / initialization phase",
+                     [({"phase": name, "status": phase["status"]}, round(phase["ms"] / 1000, 6)) for name, phase in phases.items()]))
+    families.append(("service_ready", "gauge", "1 once the background warm-up has finished and the service is ready", [({}, int(is_ready()))]))
+    clients = client_limiter.snapshot()
+    families.append(("client_rejections_total", "counter", "Requests rejected by the per-client limits",
+                     [({"reason": "concurrency"}, clients["rejected_concurrency"]), ({"reason": "rate"}, clients["rejected_rate"])]))
+    return families
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api_key_stats")
+async def api_key_stats():
+    return api_key_scheduler.snapshot()
+
+@app.get("/admission_stats")
+async def admission_stats():
+    return {"upstream": upstream_admission.snapshot(), "clients": client_limiter.snapshot()}
+
+@app.post("/clear_cache")
+async def clear_cache():
+    await asyncio.to_thread(translation_cache.clear)
+    await asyncio.to_thread(translation_memory.clear)
+    return {"status": "success"}
+
+DICTIONARY_FIELDS = ["dict_type", "key", "value", "original", "replacement", "prompt", "enabled"]
+DICTIONARY_IMPORT_FORMATS = ("csv", "jsonl")
+
+def dictionary_etag():
+    """Strong ETag for everything served from the dictionaries (entries, prompt, settings)"""
+    return f'"{dictionary_store.store_id}-{dictionary_version}"'
+
+def _etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+def settings_payload():
+    settings = dictionaries_cache.get("settings", {})
+    return {
+        "api_keys": settings.get("api_keys", []),
+        "model_names": settings.get("model_names", []),
+        "current_api_key": settings.get("current_api_key", ""),
+        "current_model_name": settings.get("current_model_name", "")
+    }
+
+def bootstrap_payload():
+    """Everything the UI needs on load, in one response"""
+    return {
+        "version": dictionary_version,
+        "dictionaries": {dict_type: dictionaries_cache.get(dict_type, {}) for dict_type in DICTIONARY_TYPES},
+        "general_prompt": general_prompt_cache,
+        "ai_mode_enabled": dictionaries_cache["settings"].get("ai_mode_enabled", False),
+        "settings": settings_payload()
+    }
+
+def dictionary_delta(since):
+    """Entries changed after version ``since`` (``entry`` is None for deletions).
+
+    Falls back to the full bootstrap payload (``full``: true) when the change
+    log does not cover ``since``, e.g. after a restart of the memory store.
+    """
+    changed = dictionary_store.changed_since(since) if since <= dictionary_version else None
+    if changed is None:
+        return {**bootstrap_payload(), "full": True}
+    delta = {"version": dictionary_version, "full": False, "changes": []}
+    for dict_type, key in changed:
+        if dict_type == "settings":
+            delta["ai_mode_enabled"] = dictionaries_cache["settings"].get("ai_mode_enabled", False)
+        elif dict_type == "general_prompt":
+            delta["general_prompt"] = general_prompt_cache
+        elif dict_type in DICTIONARY_TYPES:
+            delta["changes"].append({"dict_type": dict_type, "key": key, "entry": dictionaries_cache[dict_type].get(key)})
+    return delta
+
+def _parse_enabled(value):
+    if value is None or value == "":
+        return True
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "y", "on"):
+        return True
+    if text in ("0", "false", "no", "n", "off"):
+        return False
+    raise ValueError(f"invalid enabled value '{value}'")
+
+def dictionary_entry_from_record(record, default_type=None):
+    """Validate one imported record into (dict_type, key, entry); raises ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+    dict_type = record.get("dict_type") or default_type
+    if not dict_type:
+        raise ValueError("missing dict_type")
+    if dict_type not in DICTIONARY_TYPES:
+        raise ValueError(f"unknown dict_type '{dict_type}'")
+    key = record.get("key")
+    if not isinstance(key, str) or not key.strip():
+        raise ValueError("missing key")
+
+    def field(name):
+        value = record.get(name)
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"missing {name} for a {dict_type} entry")
+        return value
+
+    if dict_type == "keyword_based":
+        entry = {"original": field("original"), "replacement": field("replacement")}
+    elif dict_type == "gemini_keyword_prompts":
+        entry = {"keyword": key, "prompt": field("prompt")}
+    else:
+        entry = {"value": field("value")}
+    entry["enabled"] = _parse_enabled(record.get("enabled"))
+    return dict_type, key, entry
+
+def parse_dictionary_import(binary_file, import_format, default_type=None, max_errors=50):
+    """Stream-parse a CSV or JSONL upload into (changes, errors).
+
+    Later rows for the same dict_type/key win. Errors are "line N: reason"
+    strings, at most ``max_errors`` of them.
+    """
+    text = codecs.getreader("utf-8-sig")(binary_file)
+    changes = OrderedDict()
+    errors = []
+
+    if import_format == "csv":
+        reader = csv.DictReader(text)
+        records = ((reader.line_num, record) for record in reader)
+    else:
+        records = enumerate(text, start=1)
+
+    try:
+        for line_number, record in records:
+            if import_format == "jsonl":
+                if not record.strip():
+                    continue
+                try:
+                    record = json.loads(record)
+                except ValueError:
+                    errors.append(f"line {line_number}: invalid JSON")
+                    continue
+            try:
+                dict_type, key, entry = dictionary_entry_from_record(record, default_type)
+            except ValueError as e:
+                errors.append(f"line {line_number}: {e}")
+            else:
+                changes.pop((dict_type, key), None)
+                changes[(dict_type, key)] = entry
+            if len(errors) >= max_errors:
+                break
+    except UnicodeDecodeError:
+        errors.append("file must be UTF-8 encoded")
+    except csv.Error as e:
+        errors.append(f"line {reader.line_num}: {e}")
+    return [(dict_type, key, entry) for (dict_type, key), entry in changes.items()], errors
+
+def dictionary_export_record(dict_type, key, entry):
+    record = {"dict_type": dict_type, "key": key}
+    for name in ("value", "original", "replacement", "prompt"):
+        if entry.get(name) is not None:
+            record[name] = entry[name]
+    record["enabled"] = entry.get("enabled", True)
+    return record
+
+@app.get("/bootstrap")
+async def bootstrap(request: Request):
+    """Dictionaries, general prompt, AI mode and settings for the UI in one round trip"""
+    etag = dictionary_etag()
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(bootstrap_payload(), headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/dictionaries")
+async def get_dictionaries(request: Request, since: Optional[int] = None):
+    """All dictionaries, or with ``since`` only the changes after that version.
+
+    Responses carry the dictionary version as ETag; a matching If-None-Match
+    is answered with 304 Not Modified.
+    """
+    etag = dictionary_etag()
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    payload = dictionaries_cache if since is None else dictionary_delta(since)
+    return JSONResponse(payload, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.post("/dictionaries/import")
+async def import_dictionaries(file: UploadFile = File(...), format: str = Form(None),
+                              mode: str = Form("merge"), dict_type: str = Form(None)):
+    """Load many dictionary entries from CSV or JSONL as one atomic change.
+
+    ``merge`` adds or updates the entries; ``replace`` also removes the
+    existing entries of every dictionary type present in the file. If any row
+    is invalid nothing is applied and the row errors are returned.
+    """
+    global dictionaries_cache
+    import_format = (format or os.path.splitext(file.filename or "")[1].lstrip(".")).lower()
+    if import_format not in DICTIONARY_IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported import format, use one of: {', '.join(DICTIONARY_IMPORT_FORMATS)}.")
+    if mode not in ("merge", "replace"):
+        raise HTTPException(status_code=400, detail="Import mode must be 'merge' or 'replace'.")
+    if dict_type and dict_type not in DICTIONARY_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid dictionary type.")
+    if file.size is not None and file.size > DICTIONARY_IMPORT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Import file is too large.")
+    source = file.file
+    if file.size is None:
+        # Size unknown (chunked upload): read at most one byte past the limit
+        data = await file.read(DICTIONARY_IMPORT_MAX_BYTES + 1)
+        if len(data) > DICTIONARY_IMPORT_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Import file is too large.")
+        source = io.BytesIO(data)
+
+    changes, errors = await asyncio.to_thread(parse_dictionary_import, source, import_format, dict_type)
+    if errors:
+        return JSONResponse(status_code=400, content={"detail": "Import rejected, no entries were changed.", "errors": errors})
+
+    # Replace mode has to see entries other workers added
+    if dictionary_store.shared and await asyncio.to_thread(dictionary_store.current_version) != dictionary_version:
+        await asyncio.to_thread(reload_dictionaries)
+    imported_types = {change_type for change_type, _, _ in changes}
+    deleted = 0
+    if mode == "replace":
+        imported_keys = {(change_type, key) for change_type, key, _ in changes}
+        removals = [
+            (change_type, key, None)
+            for change_type in imported_types
+            for key in dictionaries_cache.get(change_type, {})
+            if (change_type, key) not in imported_keys
+        ]
+        deleted = len(removals)
+        changes += removals
+    if not changes:
+        return {"status": "success", "imported": 0, "deleted": 0, "version": dictionary_version}
+
+    new_version = await asyncio.to_thread(dictionary_store.put_entries, changes)
+    # Swap in updated copies so concurrent readers never see a half-applied import
+    updated = {change_type: dict(dictionaries_cache.get(change_type, {})) for change_type in imported_types}
+    for change_type, key, entry in changes:
+        if entry is None:
+            updated[change_type].pop(key, None)
+        else:
+            updated[change_type][key] = entry
+    dictionaries_cache = {**dictionaries_cache, **updated}
+    await bump_dictionary_version(new_version)
+    log_event("dictionary_import", format=import_format, mode=mode, imported=len(changes) - deleted, deleted=deleted)
+    return {"status": "success", "imported": len(changes) - deleted, "deleted": deleted, "version": dictionary_version}
+
+@app.get("/dictionaries/export")
+async def export_dictionaries(format: str = "jsonl", dict_type: Optional[str] = None):
+    """Stream the dictionary entries as CSV or JSONL, in the format accepted by the import"""
+    if format not in DICTIONARY_IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format, use one of: {', '.join(DICTIONARY_IMPORT_FORMATS)}.")
+    if dict_type and dict_type not in DICTIONARY_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid dictionary type.")
+    snapshot = [
+        (export_type, list(dictionaries_cache.get(export_type, {}).items()))
+        for export_type in ([dict_type] if dict_type else DICTIONARY_TYPES)
+    ]
+
+    def rows(batch_size=500):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=DICTIONARY_FIELDS) if format == "csv" else None
+        if writer is not None:
+            writer.writeheader()
+        count = 0
+        for export_type, entries in snapshot:
+            for key, entry in entries:
+                record = dictionary_export_record(export_type, key, entry)
+                if writer is not None:
+                    writer.writerow({**record, "enabled": "true" if record["enabled"] else "false"})
+                else:
+                    buffer.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+                if count % batch_size == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"{dict_type or 'dictionaries'}.{format}"
+    return StreamingResponse(rows(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "ETag": dictionary_etag()
+    })
+
+@app.post("/update_dictionary")
+async def update_dictionary(dict_type: str = Form(...), key: str = Form(...), value: str = Form(...)):
+    global dictionaries_cache
+    if dict_type not in DICTIONARY_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid dictionary type.")
+    if dict_type in ["keyword_based", "gemini_keyword_prompts"]:
+        entry = json.loads(value)
+        entry.setdefault("enabled", True)
+    else:
+        entry = {"value": value, "enabled": True}
+    new_version = await asyncio.to_thread(dictionary_store.put_entry, dict_type, key, entry)
+    dictionaries_cache[dict_type][key] = entry
+    await bump_dictionary_version(new_version)
+    return {"status": "success"}
+
+@app.delete("/delete_dictionary_entry")
+async def delete_dictionary_entry(dict_type: str = Form(...), key: str = Form(...)):
+    global dictionaries_cache
+    if key in dictionaries_cache.get(dict_type, {}):
+        new_version = await asyncio.to_thread(dictionary_store.delete_entry, dict_type, key)
+        dictionaries_cache[dict_type].pop(key, None)
+        await bump_dictionary_version(new_version)
+        return {"status": "success"}
+    return {"status": "error", "message": "Key not found"}
+
+@app.post("/toggle_dictionary_entry")
+async def toggle_dictionary_entry(dict_type: str = Form(...), key: str = Form(...), enabled: bool = Form(...)):
+    global dictionaries_cache
+    if dict_type in DICTIONARY_TYPES and key in dictionaries_cache.get(dict_type, {}):
+        entry = {**dictionaries_cache[dict_type][key], "enabled": enabled}
+        new_version = await asyncio.to_thread(dictionary_store.put_entry, dict_type, key, entry)
+        dictionaries_cache[dict_type][key] = entry
+        await bump_dictionary_version(new_version)
+        return {"status": "success"}
+    return {"status": "error", "message": "Key not found or invalid dictionary type."}
+
+@app.get("/get_general_prompt")
+async def get_general_prompt():
+    return {"prompt": general_prompt_cache}
+
+@app.post("/update_general_prompt")
+async def update_general_prompt(prompt: str = Form(...)):
+    global general_prompt_cache
+    new_version = await asyncio.to_thread(dictionary_store.put_general_prompt, prompt)
+    general_prompt_cache = prompt
+    await bump_dictionary_version(new_version)
+    return {"status": "success"}
+
+@app.get("/get_ai_mode_status")
+async def get_ai_mode_status():
+    return {"ai_mode_enabled": dictionaries_cache["settings"].get("ai_mode_enabled", False)}
+
+@app.post("/toggle_ai_mode")
+async def toggle_ai_mode(enabled: bool = Form(...)):
+    global dictionaries_cache
+    settings = {**dictionaries_cache["settings"], "ai_mode_enabled": enabled}
+    new_version = await asyncio.to_thread(dictionary_store.put_settings, settings)
+    dictionaries_cache["settings"] = settings
+    await bump_dictionary_version(new_version)
+    return {"status": "success"}
+
+@app.post("/save_settings")
+async def save_settings(api_key: str = Form(None), model_name: str = Form(None)):
+    global dictionaries_cache
+    settings = dict(dictionaries_cache.get("settings", {}))
+
+    if api_key:
+        if "api_keys" not in settings:
+            settings["api_keys"] = []
+        if api_key not in settings["api_keys"]:
+            settings["api_keys"] = ([api_key] + settings["api_keys"])[:10]
+        settings["current_api_key"] = api_key
+
+    if model_name:
+        if "model_names" not in settings:
+            settings["model_names"] = []
+        if model_name not in settings["model_names"]:
+            settings["model_names"] = ([model_name] + settings["model_names"])[:10]
+        settings["current_model_name"] = model_name
+
+    new_version = await asyncio.to_thread(dictionary_store.put_settings, settings)
+    dictionaries_cache["settings"] = settings
+    await bump_dictionary_version(new_version)
+    return {"status": "success"}
+
+@app.get("/load_settings")
+async def load_settings():
+    return settings_payload()
+
+# Health check endpoints for Cloudflare Pages
+@app.get("/health")
+async def health_check():
+    """Fast health check endpoint"""
+    return {
+        "status": "healthy", 
+        "service": "fast-translation-webapp",
+        "version": "1.0.0"
+    }
+
+@app.get("/ping")
+async def ping():
+    """Simple ping endpoint for load balancer health checks"""
+    return {"message": "pong"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the background warm-up has finished; phases that could not load
+    are listed under ``degraded``"""
+    ready = is_ready()
+    degraded = degraded_phases()
+    with _startup_lock:
+        phases = dict(startup_state["phases"])
+    payload = {
+        "status": ("degraded" if degraded else "ready") if ready else "warming_up",
+        "degraded": degraded,
+        "prewarm": startup_state["prewarm"],
+        "ready_after_ms": startup_state["ready_after_ms"],
+        "phases": phases
+    }
+    return JSONResponse(payload, status_code=200 if ready else 503)
+
+def warm_up_gemini_models():
+    """Build the configured default Gemini models ahead of the first request"""
+    settings = dictionaries_cache["settings"]
+    current_api_key = settings.get("current_api_key", GEMINI_API_KEY)
+    current_model_name = settings.get("current_model_name", "gemini-2.5-flash-preview-05-20")
+    if not current_api_key or not get_genai() or not get_types():
+        return "skipped"
+    # AI mode uses the general prompt as system instruction, keyword prompts use none
+    gemini_model_pool.warm_up(current_api_key, current_model_name, [general_prompt_cache, None])
+
+def warm_up_cloud_client():
+    if not GOOGLE_CLOUD_CREDENTIALS:
+        return "skipped"
+    if get_google_cloud_client() is None:
+        raise RuntimeError("Google Cloud Translation client could not be initialized")
+
+def _loaded(module):
+    return "ok" if module else "unavailable"
+
+# Independent warm-up chains, run on separate threads so the Gemini and Cloud imports overlap
+PREWARM_CHAINS = [
+    [
+        ("import_genai", lambda: _loaded(get_genai())),
+        ("import_genai_types", lambda: _loaded(get_types())),
+        ("import_generativelanguage", lambda: _loaded(get_glm())),
+        ("gemini_models", warm_up_gemini_models),
+    ],
+    [
+        ("import_cloud_translate", lambda: _loaded(get_translate())),
+        ("import_service_account", lambda: _loaded(get_service_account())),
+        ("cloud_client", warm_up_cloud_client),
+    ],
+]
+
+def _run_prewarm_chain(chain):
+    for name, func in chain:
+        run_startup_phase(name, func)
+
+def is_ready():
+    """Warm-up finished; SDKs or clients that could not be loaded leave the service degraded, not unready,
+    since waiting won't fix missing or invalid credentials and requests retry the setup lazily"""
+    return startup_state["finished"]
+
+def degraded_phases():
+    """Startup phases whose SDK, client or model is not available"""
+    with _startup_lock:
+        return sorted(name for name, phase in startup_state["phases"].items() if phase["status"] in ("failed", "unavailable"))
+
+async def prewarm_services():
+    """Load the SDKs, clients and default Gemini models on background threads"""
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(None, _run_prewarm_chain, chain) for chain in PREWARM_CHAINS))
+    _mark_startup_finished()
+    print(f"INFO: Warm-up finished after {startup_state['ready_after_ms']} ms, ready: {is_ready()}")
+
+def _mark_startup_finished():
+    startup_state["ready_after_ms"] = round((time.perf_counter() - _startup_started) * 1000, 2)
+    startup_state["finished"] = True
+
+# Startup event - keep it minimal for fast startup
+@app.on_event("startup")
+async def startup_event():
+    print("INFO: Fast Translation webapp starting up...")
+    record_startup_phase("module_init", time.perf_counter() - _startup_started)
+    print("INFO: Server ready to accept connections")
+    if dictionary_store.shared:
+        asyncio.get_running_loop().create_task(sync_dictionaries())
+    resume_jobs()
+    if PREWARM_ON_STARTUP:
+        # Imports and client setup run off the event loop; /health answers immediately, /ready once warm
+        asyncio.get_running_loop().create_task(prewarm_services())
+    else:
+        _mark_startup_finished()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    _upstream_executor.shutdown(wait=False, cancel_futures=True)
+    translation_cache.close()
+    translation_memory.close()
+    _log_listener.stop()
 
 if __name__ == "__main__":
     import uvicorn
@@ -2,12 +2,29 @@ let dictionaries = {};
 let fireMode = false;
 let aiModeEnabled = false;
 let lastFocusTime = 0;
+// Dictionary version the page has loaded; later refreshes only fetch the changes since then
+let dictionaryVersion = null;
+// Identifies this editor for incremental (per-sentence) translation on the server
+const editorSessionId = (window.crypto && crypto.randomUUID) ?
+    crypto.randomUUID() :
+    Date.now().toString(36) + Math.random().toString(36).slice(2);
+// Only the newest translation request may update the page
+let latestTranslationRequest = 0;
+const SUPERSEDED = { superseded: true };
+
+// Live-translation WebSocket, one per editor session; HTTP is used while it is unavailable
+const liveChannel = {
+    socket: null,
+    opening: null,
+    retryAt: 0,
+    seq: 0,
+    pending: new Map()
+};
 
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
-    fetchDictionaries();
+    fetchDictionaries();  // also loads the prompt, AI mode and settings
     setupEventListeners();
-    loadSettings();
 });
 
 function setupEventListeners() {
@@ -27,7 +44,7 @@ function setupEventListeners() {
     document.getElementById('inputText').addEventListener('input', function() {
         if (fireMode) {
             clearTimeout(window.translationTimeout);
-            window.translationTimeout = setTimeout(translateText, 500);
+            window.translationTimeout = setTimeout(() => translateText({ incremental: true }), 500);
         }
     });
 
@@ -48,17 +65,20 @@ function setupEventListeners() {
 
 async function fetchDictionaries() {
     try {
-        const response = await fetch('/dictionaries');
-        dictionaries = await response.json();
-        
-        const generalPromptResponse = await fetch('/get_general_prompt');
-        const generalPromptData = await generalPromptResponse.json();
-        document.getElementById('generalPromptTextarea').value = generalPromptData.prompt;
-
-        const aiModeStatusResponse = await fetch('/get_ai_mode_status');
-        const aiModeStatusData = await aiModeStatusResponse.json();
-        aiModeEnabled = aiModeStatusData.ai_mode_enabled;
-        updateAiModeButton();
+        if (dictionaryVersion === null) {
+            const response = await fetch('/bootstrap');
+            if (!response.ok) throw new Error('Could not load dictionaries');
+            applyBootstrap(await response.json());
+        } else {
+            const response = await fetch(`/dictionaries?since=${dictionaryVersion}`);
+            if (!response.ok) throw new Error('Could not load dictionaries');
+            const delta = await response.json();
+            if (delta.full) {
+                applyBootstrap(delta);
+            } else {
+                applyDictionaryDelta(delta);
+            }
+        }
 
         updateDictionaryLists();
     } catch (error) {
@@ -66,7 +86,35 @@ async function fetchDictionaries() {
     }
 }
 
-async function translateText() {
+function applyBootstrap(data) {
+    dictionaries = data.dictionaries;
+    dictionaryVersion = data.version;
+    document.getElementById('generalPromptTextarea').value = data.general_prompt;
+    aiModeEnabled = data.ai_mode_enabled;
+    updateAiModeButton();
+    renderSettings(data.settings);
+}
+
+function applyDictionaryDelta(delta) {
+    delta.changes.forEach(change => {
+        const entries = dictionaries[change.dict_type] = dictionaries[change.dict_type] || {};
+        if (change.entry === null) {
+            delete entries[change.key];
+        } else {
+            entries[change.key] = change.entry;
+        }
+    });
+    if ('general_prompt' in delta) {
+        document.getElementById('generalPromptTextarea').value = delta.general_prompt;
+    }
+    if ('ai_mode_enabled' in delta) {
+        aiModeEnabled = delta.ai_mode_enabled;
+        updateAiModeButton();
+    }
+    dictionaryVersion = delta.version;
+}
+
+async function translateText(options = {}) {
     const inputText = document.getElementById('inputText').value.trim();
     if (!inputText) {
         showMessage('Please enter text to translate', 'error');
@@ -76,47 +124,251 @@ async function translateText() {
     const originalTranslationDiv = document.getElementById('originalTranslation');
     const finalTranslationDiv = document.getElementById('finalTranslation');
     
-    // Show loading state
-    originalTranslationDiv.value = 'Translating...';
-    finalTranslationDiv.innerHTML = '<div class="loading">Translating...</div>';
+    // Show loading state (live typing keeps the previous translation on screen instead)
+    if (!options.incremental) {
+        originalTranslationDiv.value = 'Translating...';
+        finalTranslationDiv.innerHTML = '<div class="loading">Translating...</div>';
+    }
 
-    try {
-        const response = await fetch('/translate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                text: inputText,
-                original_english_text: inputText
-            })
-        });
+    const requestBody = JSON.stringify({
+        text: inputText,
+        original_english_text: inputText
+    });
+    const requestId = ++latestTranslationRequest;
+    const isCurrent = () => requestId === latestTranslationRequest;
 
-        if (!response.ok) {
-            const errorData = await response.json();
-            throw new Error(errorData.detail || 'Translation failed');
+    try {
+        // The live channel cancels the previous request on the server when a new one is sent
+        let data = await translateTextLive({
+            text: inputText,
+            original_english_text: inputText,
+            incremental: !!options.incremental
+        }, originalTranslationDiv, finalTranslationDiv);
+        if (data === SUPERSEDED || !isCurrent()) return;
+
+        if (!data && options.incremental) {
+            // Live typing: only sentences that changed since the last request are re-translated
+            data = await translateTextIncremental(inputText);
+        } else if (!data && window.ReadableStream && window.TextDecoder) {
+            data = await translateTextStreaming(requestBody, originalTranslationDiv, finalTranslationDiv, isCurrent);
+        }
+        if (!isCurrent()) return;
+        if (!data) {
+            data = await translateTextOnce(requestBody);
         }
+        if (!isCurrent()) return;
 
-        const data = await response.json();
-        
-        // Remove HTML tags for original translation display
-        const plainTranslation = data.translation.replace(/<[^>]*>/g, '');
-        originalTranslationDiv.value = plainTranslation;
-        
-        // Show formatted translation with highlights
-        finalTranslationDiv.innerHTML = data.translation;
-        
-        // Update used dictionaries list
-        updateUsedDictionariesList(data.used_dictionaries);
-        
+        showTranslationResult(data);
         showMessage('Translation completed successfully!', 'success');
     } catch (error) {
+        if (!isCurrent()) return;
         originalTranslationDiv.value = '';
         finalTranslationDiv.innerHTML = `<div class="error">Error: ${error.message}</div>`;
         showMessage('Translation error: ' + error.message, 'error');
     }
 }
 
+// Resolves with the open live-translation socket, or null when WebSockets are unavailable
+function openLiveChannel() {
+    if (liveChannel.socket && liveChannel.socket.readyState === WebSocket.OPEN) {
+        return Promise.resolve(liveChannel.socket);
+    }
+    if (liveChannel.opening) {
+        return liveChannel.opening;
+    }
+    if (!window.WebSocket || Date.now() < liveChannel.retryAt) {
+        return Promise.resolve(null);
+    }
+
+    liveChannel.opening = new Promise(resolve => {
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        let socket;
+        try {
+            socket = new WebSocket(`${protocol}//${location.host}/ws/translate?session_id=${encodeURIComponent(editorSessionId)}`);
+        } catch (error) {
+            resolve(null);
+            return;
+        }
+        const timer = setTimeout(() => socket.close(), 3000);
+
+        socket.onopen = () => {
+            clearTimeout(timer);
+            liveChannel.socket = socket;
+            resolve(socket);
+        };
+        socket.onmessage = handleLiveMessage;
+        socket.onclose = () => {
+            clearTimeout(timer);
+            if (liveChannel.socket !== socket) {
+                // Never opened: use HTTP for a while before trying again
+                liveChannel.retryAt = Date.now() + 30000;
+                resolve(null);
+                return;
+            }
+            liveChannel.socket = null;
+            // Requests still waiting on this socket fall back to HTTP
+            liveChannel.pending.forEach(request => request.resolve(null));
+            liveChannel.pending.clear();
+        };
+    }).finally(() => {
+        liveChannel.opening = null;
+    });
+    return liveChannel.opening;
+}
+
+function handleLiveMessage(message) {
+    const event = JSON.parse(message.data);
+    const request = liveChannel.pending.get(event.seq);
+    if (!request) return;  // superseded or cancelled
+
+    if (event.type === 'chunk') {
+        request.onChunk(event.text);
+    } else if (event.type === 'done') {
+        liveChannel.pending.delete(event.seq);
+        request.resolve(event);
+    } else if (event.type === 'error') {
+        liveChannel.pending.delete(event.seq);
+        request.reject(new Error(event.detail || 'Translation failed'));
+    }
+}
+
+// Sends a request over the live channel, superseding any request still in flight.
+// Resolves with the final "done" event, SUPERSEDED, or null if the channel is unavailable.
+async function translateTextLive(payload, originalTranslationDiv, finalTranslationDiv) {
+    const socket = await openLiveChannel();
+    if (!socket) return null;
+
+    liveChannel.pending.forEach(request => request.resolve(SUPERSEDED));
+    liveChannel.pending.clear();
+
+    const seq = ++liveChannel.seq;
+    let streamedHtml = '';
+    return new Promise((resolve, reject) => {
+        liveChannel.pending.set(seq, {
+            resolve,
+            reject,
+            onChunk(text) {
+                streamedHtml += text;
+                finalTranslationDiv.innerHTML = streamedHtml;
+                originalTranslationDiv.value = streamedHtml.replace(/<[^>]*>/g, '');
+            }
+        });
+        socket.send(JSON.stringify({ type: 'translate', seq, ...payload }));
+    });
+}
+
+async function translateTextIncremental(inputText) {
+    const response = await fetch('/translate/segments', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            text: inputText,
+            original_english_text: inputText,
+            session_id: editorSessionId
+        })
+    });
+
+    if (response.status === 404) {
+        return null;
+    }
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Translation failed');
+    }
+
+    return response.json();
+}
+
+async function translateTextOnce(requestBody) {
+    const response = await fetch('/translate', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: requestBody
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Translation failed');
+    }
+
+    return response.json();
+}
+
+// Streams NDJSON events from /translate/stream, rendering chunks as they arrive.
+// Resolves with the final "done" event, or null if streaming is not available.
+async function translateTextStreaming(requestBody, originalTranslationDiv, finalTranslationDiv, isCurrent = () => true) {
+    const response = await fetch('/translate/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: requestBody
+    });
+
+    if (response.status === 404 || response.status === 405 || !response.body) {
+        return null;
+    }
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Translation failed');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamedHtml = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        if (!isCurrent()) {
+            // A newer request was sent: stop reading so the server stops translating this one
+            reader.cancel();
+            return null;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        let newlineIndex;
+        while ((newlineIndex = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newlineIndex).trim();
+            buffer = buffer.slice(newlineIndex + 1);
+            if (!line) continue;
+
+            const event = JSON.parse(line);
+            if (event.type === 'chunk') {
+                streamedHtml += event.text;
+                finalTranslationDiv.innerHTML = streamedHtml;
+                originalTranslationDiv.value = streamedHtml.replace(/<[^>]*>/g, '');
+            } else if (event.type === 'done') {
+                return event;
+            } else if (event.type === 'error') {
+                throw new Error(event.detail || 'Translation failed');
+            }
+        }
+    }
+
+    throw new Error('Translation stream ended unexpectedly');
+}
+
+function showTranslationResult(data) {
+    const originalTranslationDiv = document.getElementById('originalTranslation');
+    const finalTranslationDiv = document.getElementById('finalTranslation');
+
+    // Remove HTML tags for original translation display
+    const plainTranslation = data.translation.replace(/<[^>]*>/g, '');
+    originalTranslationDiv.value = plainTranslation;
+    
+    // Show formatted translation with highlights
+    finalTranslationDiv.innerHTML = data.translation;
+    
+    // Update used dictionaries list
+    updateUsedDictionariesList(data.used_dictionaries);
+}
+
 async function toggleAiMode() {
     try {
         const response = await fetch('/toggle_ai_mode', {
@@ -199,34 +451,36 @@ async function saveSettings() {
 async function loadSettings() {
     try {
         const response = await fetch('/load_settings');
-        const settings = await response.json();
-
-        // Update API keys dropdown
-        const apiKeysDatalist = document.getElementById('apiKeys');
-        apiKeysDatalist.innerHTML = '';
-        settings.api_keys.forEach(key => {
-            const option = document.createElement('option');
-            option.value = key;
-            apiKeysDatalist.appendChild(option);
-        });
-
-        // Update model names dropdown
-        const modelNamesDatalist = document.getElementById('modelNames');
-        modelNamesDatalist.innerHTML = '';
-        settings.model_names.forEach(name => {
-            const option = document.createElement('option');
-            option.value = name;
-            modelNamesDatalist.appendChild(option);
-        });
-
-        // Set current values
-        document.getElementById('apiKeyInput').value = settings.current_api_key || '';
-        document.getElementById('modelNameInput').value = settings.current_model_name || '';
+        renderSettings(await response.json());
     } catch (error) {
         showMessage('Error loading settings: ' + error.message, 'error');
     }
 }
 
+function renderSettings(settings) {
+    // Update API keys dropdown
+    const apiKeysDatalist = document.getElementById('apiKeys');
+    apiKeysDatalist.innerHTML = '';
+    settings.api_keys.forEach(key => {
+        const option = document.createElement('option');
+        option.value = key;
+        apiKeysDatalist.appendChild(option);
+    });
+
+    // Update model names dropdown
+    const modelNamesDatalist = document.getElementById('modelNames');
+    modelNamesDatalist.innerHTML = '';
+    settings.model_names.forEach(name => {
+        const option = document.createElement('option');
+        option.value = name;
+        modelNamesDatalist.appendChild(option);
+    });
+
+    // Set current values
+    document.getElementById('apiKeyInput').value = settings.current_api_key || '';
+    document.getElementById('modelNameInput').value = settings.current_model_name || '';
+}
+
 async function saveGeneralPrompt() {
     const prompt = document.getElementById('generalPromptTextarea').value;
     
@@ -293,6 +547,36 @@ async function updateDictionary(dictType) {
     }
 }
 
+async function importDictionaries() {
+    const fileInput = document.getElementById('dictionaryImportFile');
+    if (!fileInput.files.length) {
+        showMessage('Please choose a CSV or JSONL file', 'error');
+        return;
+    }
+
+    try {
+        const formData = new FormData();
+        formData.append('file', fileInput.files[0]);
+        formData.append('mode', document.getElementById('dictionaryImportMode').value);
+
+        const response = await fetch('/dictionaries/import', {
+            method: 'POST',
+            body: formData
+        });
+        const result = await response.json();
+
+        if (!response.ok) {
+            const details = (result.errors || []).slice(0, 5).join('; ');
+            throw new Error(details ? `${result.detail} ${details}` : result.detail);
+        }
+        showMessage(`Imported ${result.imported} entries, removed ${result.deleted}.`, 'success');
+        fileInput.value = '';
+        fetchDictionaries();
+    } catch (error) {
+        showMessage('Error importing dictionaries: ' + error.message, 'error');
+    }
+}
+
 function clearInputFields(dictType) {
     if (dictType === 'word_replacement') {
         document.getElementById('wordReplacementKey').value = '';
@@ -453,6 +737,9 @@ function updateUsedDictionariesList(usedDictionaries) {
             li.innerHTML = `<strong>AI Mode:</strong> Used general prompt`;
         } else if (entry.type === 'gemini_keyword_prompt') {
             li.innerHTML = `<strong>Keyword Prompt:</strong> ${entry.key}`;
+        } else if (entry.type === 'translation_memory') {
+            const use = entry.mode === 'direct' ? 'reused' : 'used as reference';
+            li.innerHTML = `<strong>Translation Memory:</strong> ${Math.round(entry.similarity * 100)}% match ${use}`;
         } else {
             li.innerHTML = `<strong>${entry.type}:</strong> ${entry.key} → ${entry.replacement || entry.original}`;
         }